@@ -1,10 +1,18 @@
 import csv
+import os
 import sys
 import argparse
 
-def mask(n):
-    """Возвращает маску из n единиц (2^n - 1)."""
-    return (1 << n) - 1  # идея из файла преподавателя: создание битовой маски
+import optimizer
+from isa import INSTRUCTION_SIZE, OPCODE_BITS, OPCODES, OPERAND_BITS, mask, operand_limits
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: encode_batch работает и без него
+    np = None
+
+# Версия ассемблера: меняется при любом изменении кодирования, входит в ключ кэша сборки (build_cache.py).
+ASSEMBLER_VERSION = "2"
 
 def encode_load(const_val: int) -> int:
     """
@@ -13,9 +21,8 @@ def encode_load(const_val: int) -> int:
     B (18 бит, 4-21) = const_val
     Размер: 3 байта.
     """
-    A_OPCODE = 1
-    OPCODE_BITS = 4
-    CONST_BITS = 18
+    A_OPCODE = OPCODES["load"]
+    CONST_BITS = OPERAND_BITS[A_OPCODE]
     MAX_CONST = mask(CONST_BITS)
 
     if not (0 <= const_val <= MAX_CONST):
@@ -35,9 +42,8 @@ def encode_read(offset_val: int) -> int:
     B (6 бит, 4-9) = offset_val
     Размер: 3 байта.
     """
-    A_OPCODE = 15
-    OPCODE_BITS = 4
-    OFFSET_BITS = 6
+    A_OPCODE = OPCODES["read"]
+    OFFSET_BITS = OPERAND_BITS[A_OPCODE]
     MAX_OFFSET = mask(OFFSET_BITS)
 
     if not (0 <= offset_val <= MAX_OFFSET):
@@ -56,8 +62,7 @@ def encode_write() -> int:
     A (4 бита, 0-3) = 3
     Размер: 3 байта.
     """
-    A_OPCODE = 3
-    OPCODE_BITS = 4
+    A_OPCODE = OPCODES["write"]
 
     cmd_int = 0
     cmd_int |= (A_OPCODE & mask(OPCODE_BITS))  # идея из файла преподавателя: установка битов A
@@ -72,9 +77,8 @@ def encode_gt(offset_val: int) -> int:
     B (6 бит, 4-9) = offset_val
     Размер: 3 байта.
     """
-    A_OPCODE = 5
-    OPCODE_BITS = 4
-    OFFSET_BITS = 6
+    A_OPCODE = OPCODES["gt"]
+    OFFSET_BITS = OPERAND_BITS[A_OPCODE]
     MAX_OFFSET = mask(OFFSET_BITS)
 
     if not (0 <= offset_val <= MAX_OFFSET):
@@ -86,6 +90,76 @@ def encode_gt(offset_val: int) -> int:
 
     return cmd_int  # идея из файла преподавателя: возврат целого числа, представляющего команду
 
+
+def _raise_bad_rows(bad_rows):
+    raise ValueError(f"Недопустимый опкод или операнд вне диапазона в строках: {bad_rows}")
+
+
+def _raise_non_integer():
+    raise TypeError("Опкоды и операнды должны быть целыми числами")
+
+
+def _as_int_array(values):
+    # Неявное приведение к int64 отбросило бы дробную часть: 2.7 -> 2.
+    array_values = np.asarray(values)
+    if array_values.size and not np.issubdtype(array_values.dtype, np.integer):
+        _raise_non_integer()
+    return array_values.astype(np.int64)
+
+
+def _encode_batch_numpy(opcodes, operands):
+    ops = _as_int_array(opcodes)
+    vals = _as_int_array(operands)
+    if ops.ndim != 1 or ops.shape != vals.shape:
+        raise ValueError("Массивы опкодов и операндов должны быть одномерными и одной длины")
+
+    limits = np.array(operand_limits(), dtype=np.int64)
+    known = (ops >= 0) & (ops < len(limits))
+    row_limits = np.where(known, limits[np.where(known, ops, 0)], -1)
+    bad = (row_limits < 0) | (vals < 0) | (vals > row_limits)
+    if bad.any():
+        _raise_bad_rows(np.flatnonzero(bad).tolist())
+
+    words = (ops | (vals << OPCODE_BITS)).astype("<u4")
+    return words.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def _encode_batch_python(opcodes, operands):
+    if len(opcodes) != len(operands):
+        raise ValueError("Массивы опкодов и операндов должны быть одной длины")
+    if not all(isinstance(op, int) and isinstance(val, int) for op, val in zip(opcodes, operands)):
+        _raise_non_integer()
+
+    limits = operand_limits()
+    bad_rows = [i for i, (op, val) in enumerate(zip(opcodes, operands))
+                if not (0 <= op < len(limits)) or limits[op] < 0 or not (0 <= val <= limits[op])]
+    if bad_rows:
+        _raise_bad_rows(bad_rows)
+
+    bytecode = bytearray(INSTRUCTION_SIZE * len(opcodes))
+    pos = 0
+    for op, val in zip(opcodes, operands):
+        word = op | (val << OPCODE_BITS)
+        bytecode[pos] = word & 0xFF
+        bytecode[pos + 1] = (word >> 8) & 0xFF
+        bytecode[pos + 2] = word >> 16
+        pos += INSTRUCTION_SIZE
+    return bytes(bytecode)
+
+
+def encode_batch(opcodes, operands) -> bytes:
+    """
+    Пакетно кодирует программу, заданную столбцами: opcodes - числовые опкоды (см. OPCODES),
+    operands - значения поля B (для write - 0). Возвращает упакованный байткод
+    (3 байта на команду, Little-Endian). Все строки с недопустимым опкодом или операндом
+    вне диапазона сообщаются одной ошибкой ValueError, нецелые значения - ошибкой TypeError.
+    При наличии NumPy кодирование и проверка выполняются векторно.
+    """
+    if np is not None:
+        return _encode_batch_numpy(opcodes, operands)
+    return _encode_batch_python(opcodes, operands)
+
+
 def parse_csv_row(row):
     """Парсит одну строку CSV."""
     if not row or not any(field.strip() for field in row):  # Пропускаем пустые строки
@@ -101,30 +175,43 @@ def parse_csv_row(row):
         raise ValueError(f"Неверный формат аргумента в строке: {row}")
 
     # Проверяем, поддерживаем ли мы эту команду
-    if op not in {"load", "read", "write", "gt"}: # Добавляем "gt" в список поддерживаемых
+    if op not in OPCODES: # Мнемоники берутся из общей таблицы ISA (isa.py)
         raise ValueError(f"Неизвестная команда в строке: {row}")
 
     return {"op": op, "args": args}
 
 
+def iter_csv_lines(lines):
+    """
+    Разбирает строки ассемблерного кода в формате CSV (файл, список строк, io.StringIO),
+    выдавая команды промежуточного представления по одной.
+    """
+    reader = csv.reader(lines)
+    for i, row in enumerate(reader, start=1):
+        try:
+            parsed_instr = parse_csv_row(row)
+        except ValueError as e:
+            print(f"Ошибка при разборе CSV файла в строке {i}: {e}")
+            raise  # Прерываем с ошибкой
+        if parsed_instr:  # Пропускаем пустые строки
+            yield parsed_instr
+
+
+def iter_csv_instructions(csv_filename: str):
+    """
+    Лениво разбирает CSV файл с ассемблерным кодом, выдавая команды промежуточного
+    представления по одной. Память не зависит от размера программы.
+    """
+    with open(csv_filename, newline='', encoding='utf-8') as csvfile:
+        yield from iter_csv_lines(csvfile)
+
+
 def assemble_from_csv(csv_filename: str):
     """
     Транслирует CSV файл с ассемблерным кодом в промежуточное представление.
     """
-    intermediate_repr = []
-    with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile)
-        for i, row in enumerate(reader, start=1):
-            try:
-                parsed_instr = parse_csv_row(row)
-                if parsed_instr:  # Пропускаем пустые строки
-                    intermediate_repr.append(
-                        parsed_instr)  # идея из файла преподавателя: формирование списка команд (хотя там YAML -> список)
-            except ValueError as e:
-                print(f"Ошибка при разборе CSV файла в строке {i}: {e}")
-                raise  # Прерываем с ошибкой
-
-    return intermediate_repr  # идея из файла преподавателя: возврат внутреннего представления программы
+    # идея из файла преподавателя: формирование списка команд (хотя там YAML -> список)
+    return list(iter_csv_instructions(csv_filename))  # идея из файла преподавателя: возврат внутреннего представления программы
 
 def run_tests():
     """Проверяет правильность кодирования команд по тестовым векторам."""
@@ -163,6 +250,13 @@ def run_tests():
             f"Тест Gt не пройден: получено {list(generated_gt_bytes)}, ожидалось {list(expected_gt_bytes)}"
         print(f"Gt(27) тест пройден: {list(generated_gt_bytes)}")
 
+        generated_batch_bytes = encode_batch([1, 15, 3, 5], [267, 34, 0, 27])
+        expected_batch_bytes = (expected_load_bytes + expected_read_bytes +
+                                expected_write_bytes + expected_gt_bytes)
+        assert generated_batch_bytes == expected_batch_bytes, \
+            f"Тест encode_batch не пройден: получено {list(generated_batch_bytes)}, ожидалось {list(expected_batch_bytes)}"
+        print(f"encode_batch тест пройден: {list(generated_batch_bytes)}")
+
         print("Все тесты пройдены!")
         return True
 
@@ -182,58 +276,93 @@ def display_intermediate_fields(interp_program):
         args = instr["args"]
 
         print(f"Op: {op}")
-        if op == "load":
-            # A=1 (из спецификации), B=args[0]
-            print(f"  A: 1 (4 bits)")
-            print(f"  B: {args[0]} (18 bits)")
-        elif op == "read":
-            # A=15 (из спецификации), B=args[0]
-            print(f"  A: 15 (4 bits)")
-            print(f"  B: {args[0]} (6 bits)")
-        elif op == "write":
-            # A=3 (из спецификации)
-            print(f"  A: 3 (4 bits)")
-        elif op == "gt":
-            # A=5 (из спецификации), B=args[0]
-            print(f"  A: 5 (4 bits)")
-            print(f"  B: {args[0]} (6 bits)")
+        if op in OPCODES:
+            # Поля A и B и их ширина - из таблицы ISA (isa.py)
+            opcode = OPCODES[op]
+            print(f"  A: {opcode} ({OPCODE_BITS} bits)")
+            if OPERAND_BITS[opcode]:
+                print(f"  B: {args[0]} ({OPERAND_BITS[opcode]} bits)")
         else:
             print(f"  Unknown op: {op}")
 
 
+STREAM_CHUNK_SIZE = 65536  # количество команд в буфере потокового ассемблера
+
+
+# Функции кодирования команд по мнемонике; количество аргументов определяется таблицей ISA.
+ENCODERS = {"load": encode_load, "read": encode_read, "write": encode_write, "gt": encode_gt}
+
+
+def encode_instruction(instruction) -> int:
+    """Кодирует одну команду промежуточного представления в целое число."""
+    op = instruction.get("op")
+    args = instruction.get("args", [])
+
+    if op not in OPCODES:
+        raise ValueError(f"Неизвестная команда: {op}")
+    arg_count = 1 if OPERAND_BITS[OPCODES[op]] else 0
+    if len(args) != arg_count:
+        raise ValueError(f"Команда '{op}' ожидает {arg_count} {'аргумент' if arg_count == 1 else 'аргументов'}, "
+                         f"получено {len(args)}")
+    return ENCODERS[op](*args)
+
+
 def translate_to_machine_code_bytes(intermediate_program):
     """
     Преобразует список команд из промежуточного представления в бинарный код.
     """
-    bytecode = b""
+    bytecode = bytearray(INSTRUCTION_SIZE * len(intermediate_program))
+    pos = 0
     for instruction in intermediate_program:  # идея из файла преподавателя: цикл по списку команд
-        op = instruction.get("op")
-        args = instruction.get("args", [])
-
-        if op == "load":
-            if len(args) != 1:
-                raise ValueError(f"Команда 'load' ожидает 1 аргумент, получено {len(args)}")
-            bytecode += encode_load(args[0]).to_bytes(3,
-                                                      "little")  # идея из файла преподавателя: вызов функции кодирования и добавление к результату
-        elif op == "read":
-            if len(args) != 1:
-                raise ValueError(f"Команда 'read' ожидает 1 аргумент, получено {len(args)}")
-            bytecode += encode_read(args[0]).to_bytes(3,
-                                                      "little")  # идея из файла преподавателя: вызов функции кодирования и добавление к результату
-        elif op == "write":
-            if len(args) != 0:
-                raise ValueError(f"Команда 'write' ожидает 0 аргументов, получено {len(args)}")
-            bytecode += encode_write().to_bytes(3,
-                                                "little")  # идея из файла преподавателя: вызов функции кодирования и добавление к результату
-        elif op == "gt": # <-- Добавленная ветка для gt
-            if len(args) != 1:
-                raise ValueError(f"Команда 'gt' ожидает 1 аргумент, получено {len(args)}")
-            bytecode += encode_gt(args[0]).to_bytes(3,
-                                                    "little")  # идея из файла преподавателя: вызов функции кодирования и добавление к результату
-        else:
-            raise ValueError(f"Неизвестная команда: {op}")
+        # идея из файла преподавателя: вызов функции кодирования и добавление к результату
+        bytecode[pos:pos + INSTRUCTION_SIZE] = encode_instruction(instruction).to_bytes(INSTRUCTION_SIZE, "little")
+        pos += INSTRUCTION_SIZE
+
+    return bytes(bytecode)  # идея из файла преподавателя: возврат собранного байтового объекта
+
+
+def assemble_csv_to_file(csv_filename: str, output_filename: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    Потоковое ассемблирование: команды читаются из CSV по одной, кодируются в заранее
+    выделенный буфер на chunk_size команд и дописываются в выходной файл по мере заполнения.
+    Результат сначала пишется во временный файл и переименовывается только при успехе.
+    Возвращает (количество команд, размер бинарного файла в байтах).
+    """
+    buffer = bytearray(INSTRUCTION_SIZE * chunk_size)
+    pos = 0
+    count = 0
+    tmp_filename = output_filename + ".tmp"
+    try:
+        with open(tmp_filename, 'wb') as f:
+            for instruction in iter_csv_instructions(csv_filename):
+                buffer[pos:pos + INSTRUCTION_SIZE] = encode_instruction(instruction).to_bytes(INSTRUCTION_SIZE, "little")
+                pos += INSTRUCTION_SIZE
+                count += 1
+                if pos == len(buffer):
+                    f.write(buffer)
+                    pos = 0
+            f.write(memoryview(buffer)[:pos])
+        os.replace(tmp_filename, output_filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    return count, count * INSTRUCTION_SIZE
+
+def optimize_csv_program(intermediate_program, verify=False, memory_size=optimizer.MEMORY_SIZE,
+                         word_bits=optimizer.WORD_BITS):
+    """
+    Оптимизирует промежуточное представление для УВМ с заданными размером памяти и шириной слова
+    и при verify проверяет результат на интерпретаторе.
+    """
+    optimized = optimizer.optimize_program(intermediate_program, memory_size, word_bits)
+    print(f"Оптимизация: {len(intermediate_program)} -> {len(optimized)} команд")
+    if verify:
+        optimizer.verify_optimization(intermediate_program, optimized, memory_size, word_bits)
+        print("Проверка оптимизации пройдена: дампы памяти совпадают")
+    return optimized
 
-    return bytecode  # идея из файла преподавателя: возврат собранного байтового объекта
 
 def main():
     parser = argparse.ArgumentParser(description="Ассемблер для УВМ Вариант 20.")
@@ -241,6 +370,15 @@ def main():
     parser.add_argument("output_file", help="Путь к выходному бинарному файлу (.bin)")
     parser.add_argument("--test-mode", action="store_true",
                         help="Запустить внутренние тесты и показать промежуточное представление / байткод.")
+    parser.add_argument("--optimize", action="store_true",
+                        help="Оптимизировать промежуточное представление перед кодированием.")
+    parser.add_argument("--verify-optimization", action="store_true",
+                        help="Оптимизировать и проверить на интерпретаторе, что дамп памяти не изменился.")
+    parser.add_argument("--memory-size", type=int, default=optimizer.MEMORY_SIZE,
+                        help="Размер памяти УВМ (в словах), для которой оптимизируется программа "
+                             "(должен совпадать с --memory-size интерпретатора).")
+    parser.add_argument("--word-bits", type=int, default=optimizer.WORD_BITS,
+                        help="Ширина слова памяти УВМ, для которой оптимизируется программа.")
 
     args = parser.parse_args()
 
@@ -252,6 +390,9 @@ def main():
         # Загружаем промежуточное представление из CSV файла
         try:
             intermediate_program = assemble_from_csv(args.input_file)
+            if args.optimize or args.verify_optimization:
+                intermediate_program = optimize_csv_program(intermediate_program, args.verify_optimization,
+                                                            args.memory_size, args.word_bits)
 
             # Вывод внутреннего представления (поля и значения) - Требование Этапа 1
             display_intermediate_fields(intermediate_program)
@@ -272,20 +413,25 @@ def main():
             sys.exit(1)
 
     else:
-        # Обычная сборка
+        # Обычная сборка (потоковая: программа не загружается в память целиком)
         try:
-            intermediate_program = assemble_from_csv(args.input_file)
-            bytecode = translate_to_machine_code_bytes(
-                intermediate_program)  # идея из файла преподавателя: вызов функции генерации байтов
-
-            with open(args.output_file, 'wb') as f:
-                f.write(bytecode)  # идея из файла преподавателя: запись результата в бинарный файл
+            if args.optimize or args.verify_optimization:
+                # Оптимизатору нужна вся программа, поэтому сборка идёт через промежуточное представление
+                intermediate_program = optimize_csv_program(assemble_from_csv(args.input_file),
+                                                            args.verify_optimization,
+                                                            args.memory_size, args.word_bits)
+                bytecode = translate_to_machine_code_bytes(intermediate_program)
+                with open(args.output_file, 'wb') as f:
+                    f.write(bytecode)  # идея из файла преподавателя: запись результата в бинарный файл
+                count, size = len(intermediate_program), len(bytecode)
+            else:
+                count, size = assemble_csv_to_file(args.input_file, args.output_file)  # идея из файла преподавателя: вызов функции генерации байтов
 
             print(f"Ассемблировано {args.input_file} -> {args.output_file}")
             print(
-                f"Количество ассемблированных команд: {len(intermediate_program)}")  # Требование Этап 2, но логично выводить
+                f"Количество ассемблированных команд: {count}")  # Требование Этап 2, но логично выводить
             print(
-                f"Размер бинарного файла: {len(bytecode)} байт")  # идея из файла преподавателя: вывод размера результата
+                f"Размер бинарного файла: {size} байт")  # идея из файла преподавателя: вывод размера результата
 
         except FileNotFoundError:
             print(f"Ошибка: Входной файл '{args.input_file}' не найден.")
@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import argparse
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from interpr import (UVM, MEMORY_SIZE, STACK_SIZE, WORD_BITS, open_program, decode_program, execute,
+                     memory_dump, sparse_memory_dump, load_snapshot)
+
+# Декодированные программы, общие для всех задач процесса-исполнителя: {путь к .bin: DecodedProgram}.
+# Заполняется в родительском процессе и передаётся исполнителям через initializer один раз.
+_PROGRAMS = {}
+_VM_OPTIONS = {}
+# Заранее подготовленное состояние УВМ (снимок), с которого стартует каждая задача, или None.
+# Исполнители получают его один раз (см. _pool_context); каждая задача выполняется на своей
+# копии (clone): копируется память снимка, а общее начало программы заново не выполняется.
+_BASE_VM = None
+_SPARSE = False # сохранять в результатах только записанные ячейки памяти
+
+
+def load_manifest(manifest_file):
+    """
+    Читает манифест пакетного запуска (JSON).
+    Формат: {"memory_size": ..., "word_bits": ..., "stack_size": ..., "snapshot": снимок УВМ,
+    "jobs": [задача, ...]} или просто список задач. При заданном снимке параметры памяти
+    берутся из него, а программы выполняются с сохранённого в снимке PC.
+    Задача: {"binary": путь к .bin, "memory": начальная память, "start_addr": начало дампа,
+    "end_addr": конец дампа}. Начальная память задаётся словарём {адрес: значение} или списком
+    значений с адреса 0. Пути к .bin и снимку берутся относительно манифеста.
+    """
+    with open(manifest_file, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    for job in manifest["jobs"]:
+        job["binary"] = os.path.join(base_dir, job["binary"])
+    if manifest.get("snapshot"):
+        manifest["snapshot"] = os.path.join(base_dir, manifest["snapshot"])
+    return manifest
+
+
+def apply_memory_image(vm_instance, image):
+    """
+    Записывает начальное содержимое памяти (словарь {адрес: значение} или список) в УВМ.
+    Адреса вне памяти УВМ - ошибка ValueError (до записи каких-либо значений).
+    """
+    items = [(int(addr), value) for addr, value in image.items()] if isinstance(image, dict) else list(enumerate(image))
+    bad = [addr for addr, _ in items if not 0 <= addr < vm_instance.memory_size]
+    if bad:
+        raise ValueError(f"Адреса начальной памяти вне диапазона 0..{vm_instance.memory_size - 1}: {bad[:20]}")
+    for addr, value in items:
+        vm_instance.write_memory(addr, value)
+
+
+def _init_worker(programs, vm_options, sparse, base_vm=None):
+    global _PROGRAMS, _VM_OPTIONS, _SPARSE, _BASE_VM
+    _PROGRAMS = programs
+    _VM_OPTIONS = vm_options
+    _SPARSE = sparse
+    _BASE_VM = base_vm
+
+
+def _pool_context():
+    """
+    Контекст запуска процессов пула: fork, если он доступен, - тогда программы и снимок
+    не сериализуются, а страницы памяти родителя разделяются исполнителями копированием
+    при записи. Без fork (Windows) данные initializer сериализуются для каждого исполнителя.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def run_job(job):
+    """
+    Выполняет одну задачу манифеста на новой УВМ (или копии подготовленного снимка)
+    и возвращает результат с дампом памяти.
+    """
+    index, job = job
+    result = {"job": index, "binary": job["binary"]}
+    try:
+        vm = _BASE_VM.clone() if _BASE_VM is not None else UVM(**_VM_OPTIONS)
+        start_fused = vm.fused_count # слитые операции начала программы, учтённые в снимке
+        apply_memory_image(vm, job.get("memory", {}))
+        program = _PROGRAMS[job["binary"]]
+        result["executed"] = execute(program, vm)
+        if result["executed"] < program.instruction_count:
+            result["error"] = f"Выполнение остановлено на PC {vm.pc}: неизвестный опкод"
+            return result
+        result["fused"] = vm.fused_count - start_fused
+        dump = sparse_memory_dump if _SPARSE else memory_dump
+        result["dump"] = dump(vm, job.get("start_addr", 0), job.get("end_addr", vm.memory_size - 1))
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def run_batch(manifest, workers=None, chunksize=None, fuse=False, sparse=False):
+    """
+    Выполняет все задачи манифеста в пуле процессов (workers <= 1 - в текущем процессе).
+    Каждый бинарный файл декодируется один раз в родительском процессе; снимок из манифеста
+    тоже загружается один раз и передаётся исполнителям вместе с программами.
+    При fuse программы декодируются со слитыми операциями, при sparse дампы содержат
+    только записанные ячейки.
+    Если бинарный файл не удаётся загрузить, его задачи не выполняются и получают "error",
+    остальные задачи выполняются как обычно.
+    chunksize по умолчанию делит задачи примерно на четыре порции на процесс.
+    Возвращает (результаты в порядке задач, статистика производительности).
+    """
+    jobs = manifest["jobs"]
+    base_vm = load_snapshot(manifest["snapshot"]) if manifest.get("snapshot") else None
+    start_pc = base_vm.pc if base_vm is not None else 0
+    programs = {}
+    load_errors = {} # путь к .bin -> текст ошибки загрузки
+    for job in jobs:
+        binary = job["binary"]
+        if binary in programs or binary in load_errors:
+            continue
+        try:
+            with open_program(binary) as bytecode:
+                programs[binary] = decode_program(bytecode, fuse=fuse, start_pc=start_pc)
+        except FileNotFoundError:
+            load_errors[binary] = f"Файл '{binary}' не найден"
+        except OSError as e:
+            load_errors[binary] = f"Не удалось загрузить программу: {e}"
+
+    results = [{"job": index, "binary": job["binary"], "error": load_errors[job["binary"]]}
+               if job["binary"] in load_errors else None for index, job in enumerate(jobs)]
+    runnable = [(index, job) for index, job in enumerate(jobs) if job["binary"] in programs]
+    vm_options = {
+        "memory_size": manifest.get("memory_size", MEMORY_SIZE),
+        "word_bits": manifest.get("word_bits", WORD_BITS),
+        "stack_size": manifest.get("stack_size", STACK_SIZE),
+    }
+
+    start = time.perf_counter()
+    if workers is not None and workers <= 1:
+        _init_worker(programs, vm_options, sparse, base_vm)
+        completed = map(run_job, runnable)
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(runnable) // (4 * (workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(), initializer=_init_worker,
+                                 initargs=(programs, vm_options, sparse, base_vm)) as executor:
+            completed = list(executor.map(run_job, runnable, chunksize=chunksize))
+    for result in completed:
+        results[result["job"]] = result
+    elapsed = time.perf_counter() - start
+
+    instructions = sum(result.get("executed", 0) for result in results)
+    stats = {
+        "runs": len(results),
+        "errors": sum(1 for result in results if "error" in result),
+        "programs": len(programs),
+        "instructions": instructions,
+        "fused_ops": sum(result.get("fused", 0) for result in results),
+        "seconds": elapsed,
+        "runs_per_second": len(results) / elapsed if elapsed else 0.0,
+        "instructions_per_second": instructions / elapsed if elapsed else 0.0,
+    }
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный запуск программ УВМ Вариант 20 по манифесту.")
+    parser.add_argument("manifest_file", help="Путь к манифесту задач (.json)")
+    parser.add_argument("output_file", help="Путь к файлу со сводными результатами (.json)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Количество процессов (по умолчанию - число ядер, 1 - без пула процессов).")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Количество задач, передаваемых процессу за один раз (по умолчанию подбирается автоматически).")
+    parser.add_argument("--fuse", action="store_true",
+                        help="Выполнять типовые последовательности команд как слитые операции.")
+    parser.add_argument("--sparse", action="store_true",
+                        help="Сохранять в дампах только ячейки, в которые выполнялась запись.")
+
+    args = parser.parse_args()
+
+    try:
+        manifest = load_manifest(args.manifest_file)
+        results, stats = run_batch(manifest, workers=args.workers, chunksize=args.chunksize,
+                                   fuse=args.fuse, sparse=args.sparse)
+    except FileNotFoundError as e:
+        print(f"Ошибка: Файл '{e.filename}' не найден.")
+        sys.exit(1)
+    except (KeyError, ValueError) as e:
+        print(f"Ошибка в манифесте: {e}")
+        sys.exit(1)
+
+    try:
+        with open(args.output_file, 'w', encoding='utf-8') as f:
+            json.dump({"stats": stats, "results": results}, f, ensure_ascii=False)
+    except Exception as e:
+        print(f"Ошибка при сохранении результатов: {e}")
+        sys.exit(1)
+
+    print(f"Выполнено запусков: {stats['runs']} (ошибок: {stats['errors']}, программ: {stats['programs']})")
+    print(f"Время: {stats['seconds']:.3f} с, запусков/с: {stats['runs_per_second']:.1f}, "
+          f"команд/с: {stats['instructions_per_second']:.0f}")
+    print(f"Результаты сохранены в {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
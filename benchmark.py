@@ -0,0 +1,243 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import platform
+import argparse
+import datetime
+import tempfile
+import importlib
+import subprocess
+import tracemalloc
+
+import jit
+from isa import OPCODES, OPERAND_BITS, mask
+from interpr import UVM, MEMORY_SIZE, STACK_SIZE, WORD_BITS, decode_program, execute
+
+assembler = importlib.import_module("12312312")
+
+DEFAULT_MIX = {"load": 4, "read": 1, "write": 1, "gt": 1}
+# Сколько элементов команда снимает со стека и сколько кладёт обратно.
+STACK_EFFECT = {"load": (0, 1), "read": (1, 1), "write": (2, 0), "gt": (3, 0)}
+MAX_OFFSET = max(mask(OPERAND_BITS[OPCODES[op]]) for op in ("read", "gt"))  # максимальное смещение read/gt
+
+
+def parse_mix(text):
+    """Разбирает состав команд вида "load=4,read=1,write=1,gt=1"."""
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip().lower()
+        if op not in STACK_EFFECT:
+            raise ValueError(f"Неизвестная команда в составе: {op}")
+        mix[op] = float(weight)
+    return mix
+
+
+def generate_program(size, mix=None, memory_size=MEMORY_SIZE, max_depth=64, seed=0):
+    """
+    Генерирует синтетическую программу (промежуточное представление) из size команд
+    с заданными весами команд. Программа корректна: стек не опустошается и не превышает
+    max_depth, а все адреса вместе со смещением попадают в память размера memory_size.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    max_value = memory_size - MAX_OFFSET - 1  # значения в памяти и на стеке служат адресами
+    if max_value < 0:
+        raise ValueError(f"Размер памяти должен быть больше {MAX_OFFSET}")
+
+    program = []
+    depth = 0
+    for _ in range(size):
+        allowed = [op for op, (pops, pushes) in STACK_EFFECT.items()
+                   if mix.get(op, 0) > 0 and depth >= pops and depth - pops + pushes <= max_depth]
+        op = rng.choices(allowed, [mix[op] for op in allowed])[0] if allowed else "load"
+        if op == "load":
+            program.append({"op": "load", "args": [rng.randint(0, max_value)]})
+        elif op == "write":
+            program.append({"op": "write", "args": []})
+        else:
+            program.append({"op": op, "args": [rng.randint(0, mask(OPERAND_BITS[OPCODES[op]]))]})
+        pops, pushes = STACK_EFFECT[op]
+        depth += pushes - pops
+    return program
+
+
+def write_csv(program, csv_filename):
+    """Сохраняет промежуточное представление в CSV файл ассемблера."""
+    with open(csv_filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for instr in program:
+            writer.writerow([instr["op"], *instr["args"]])
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _peak_memory(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _best(repeat, func, *args, **kwargs):
+    """Лучшее время из repeat запусков и результат последнего."""
+    best = None
+    for _ in range(repeat):
+        seconds, result = _timed(func, *args, **kwargs)
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def _run_program(program, memory_size):
+    vm = UVM(memory_size, stack_size=STACK_SIZE)
+    return execute(program, vm)
+
+
+def _run_compiled(compiled, memory_size):
+    vm = UVM(memory_size, stack_size=STACK_SIZE)
+    return compiled.run(vm)
+
+
+def benchmark_case(size, mix=None, memory_size=MEMORY_SIZE, repeat=3, measure_memory=True, seed=0):
+    """Измеряет ассемблер и интерпретатор на одной синтетической программе."""
+    mix = mix or DEFAULT_MIX
+    program = generate_program(size, mix, memory_size, seed=seed)
+    result = {"size": size, "mix": mix, "memory_size": memory_size}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_filename = os.path.join(tmp_dir, "bench.csv")
+        bin_filename = os.path.join(tmp_dir, "bench.bin")
+        write_csv(program, csv_filename)
+
+        seconds, intermediate = _best(repeat, assembler.assemble_from_csv, csv_filename)
+        result["assemble_seconds"] = seconds
+        seconds, bytecode = _best(repeat, assembler.translate_to_machine_code_bytes, intermediate)
+        result["translate_seconds"] = seconds
+        result["translate_bytes_per_second"] = len(bytecode) / seconds if seconds else 0.0
+        seconds, _ = _best(repeat, assembler.assemble_csv_to_file, csv_filename, bin_filename)
+        result["stream_assemble_seconds"] = seconds
+        result["stream_bytes_per_second"] = len(bytecode) / seconds if seconds else 0.0
+
+        if measure_memory:
+            result["assemble_peak_bytes"] = _peak_memory(assembler.assemble_from_csv, csv_filename)
+            result["translate_peak_bytes"] = _peak_memory(assembler.translate_to_machine_code_bytes, intermediate)
+            result["stream_assemble_peak_bytes"] = _peak_memory(assembler.assemble_csv_to_file,
+                                                                csv_filename, bin_filename)
+
+    for fuse in (False, True):
+        prefix = "execute_fused" if fuse else "execute"
+        decoded = decode_program(bytecode, fuse=fuse)
+        seconds, executed = _best(repeat, _run_program, decoded, memory_size)
+        result[f"{prefix}_seconds"] = seconds
+        result[f"{prefix}_instructions_per_second"] = executed / seconds if seconds else 0.0
+        if measure_memory:
+            result[f"{prefix}_peak_bytes"] = _peak_memory(_run_program, decoded, memory_size)
+    jit.clear_cache()
+    decoded = decode_program(bytecode)
+    result["jit_compile_seconds"], compiled = _timed(jit.compile_program, decoded, memory_size, WORD_BITS)
+    seconds, executed = _best(repeat, _run_compiled, compiled, memory_size)
+    result["execute_jit_seconds"] = seconds
+    result["execute_jit_instructions_per_second"] = executed / seconds if seconds else 0.0
+    result["decode_seconds"], _ = _best(repeat, decode_program, bytecode)
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(output_file):
+    """
+    Читает файл истории бенчмарка (JSON список запусков); если файла нет - пустая история.
+    Файл другого формата - ошибка ValueError, чтобы он не был перезаписан.
+    """
+    if not os.path.exists(output_file):
+        return []
+    try:
+        with open(output_file, encoding='utf-8') as f:
+            history = json.load(f)
+    except ValueError as e:
+        raise ValueError(f"Файл истории {output_file} не является JSON: {e}") from None
+    if not isinstance(history, list) or not all(isinstance(run, dict) and isinstance(run.get("results"), list)
+                                                for run in history):
+        raise ValueError(f"Файл {output_file} не является историей бенчмарка (JSON список запусков)")
+    return history
+
+
+def save_results(results, output_file, history=None):
+    """
+    Дописывает запуск бенчмарка в файл истории (JSON список запусков) и возвращает
+    предыдущий запуск, если он был. history - уже прочитанная история (load_history).
+    """
+    if history is None:
+        history = load_history(output_file)
+    previous = history[-1] if history else None
+    history.append({
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "results": results,
+    })
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2, ensure_ascii=False)
+    return previous
+
+
+def _print_result(result, previous_results):
+    print(f"--- {result['size']} команд ---")
+    previous = next((p for p in previous_results
+                     if p["size"] == result["size"] and p["mix"] == result["mix"]), None)
+    for key, value in result.items():
+        if key in ("size", "mix"):
+            continue
+        line = f"  {key}: {value:.6g}" if isinstance(value, float) else f"  {key}: {value}"
+        if previous and key != "memory_size" and previous.get(key):
+            line += f" (было {previous[key]:.6g}, x{value / previous[key]:.2f})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк ассемблера и интерпретатора УВМ Вариант 20.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000],
+                        help="Размеры синтетических программ (количество команд).")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Веса команд, например load=4,read=1,write=1,gt=1.")
+    parser.add_argument("--memory-size", type=int, default=MEMORY_SIZE, help="Размер памяти УВМ.")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество повторов (берётся лучшее время).")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение генератора программ.")
+    parser.add_argument("--no-memory", action="store_true", help="Не измерять пиковое потребление памяти.")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="Файл истории результатов (JSON), новый запуск дописывается в конец.")
+
+    args = parser.parse_args()
+
+    try:
+        history = load_history(args.output) # до измерений: неверный файл истории не должен их обесценить
+        results = [benchmark_case(size, args.mix, args.memory_size, args.repeat,
+                                  measure_memory=not args.no_memory, seed=args.seed)
+                   for size in args.sizes]
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+    previous = save_results(results, args.output, history)
+    for result in results:
+        _print_result(result, previous["results"] if previous else [])
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
+import optimizer
+
+assembler = importlib.import_module("12312312")
+
+DEFAULT_CACHE_DIR = ".uvm_cache"
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # байт
+
+
+def source_key(csv_filename, optimize=False, memory_size=optimizer.MEMORY_SIZE, word_bits=optimizer.WORD_BITS):
+    """
+    Ключ кэша: SHA-256 от версии ассемблера, версии оптимизатора (при optimize), параметров УВМ,
+    для которой оптимизируется программа, и содержимого CSV.
+    """
+    optimizer_version = optimizer.OPTIMIZER_VERSION if optimize else "-"
+    digest = hashlib.sha256()
+    digest.update(f"{assembler.ASSEMBLER_VERSION}:{optimizer_version}:{memory_size}:{word_bits}:".encode())
+    with open(csv_filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BuildCache:
+    """
+    Кэш результатов ассемблирования в каталоге: для каждого ключа хранятся <ключ>.bin
+    (байткод) и <ключ>.json (промежуточное представление). Время последнего использования -
+    mtime .bin файла; при превышении max_size удаляются давно не использованные записи.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + ".bin"), os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        """Возвращает байткод по ключу (и отмечает запись как использованную) или None."""
+        bin_path, ir_path = self._paths(key)
+        try:
+            with open(bin_path, 'rb') as f:
+                bytecode = f.read()
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(ir_path):
+            return None
+        os.utime(bin_path)
+        return bytecode
+
+    def get_ir(self, key):
+        """Возвращает промежуточное представление по ключу или None."""
+        try:
+            with open(self._paths(key)[1], encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, bytecode, intermediate_program):
+        bin_path, ir_path = self._paths(key)
+        _write_atomic(ir_path, json.dumps(intermediate_program).encode('utf-8'))
+        _write_atomic(bin_path, bytecode)  # .bin пишется последним: запись видна только целиком
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока размер кэша превышает max_size. Возвращает число удалённых."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".bin"):
+                continue
+            key = name[:-len(".bin")]
+            bin_path, ir_path = self._paths(key)
+            try:
+                size = os.path.getsize(bin_path) + os.path.getsize(ir_path)
+                used = os.path.getmtime(bin_path)
+            except FileNotFoundError:
+                continue
+            entries.append((used, key, size))
+            total += size
+
+        removed = 0
+        for used, key, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def _assemble(csv_filename, optimize, memory_size, word_bits):
+    intermediate_program = assembler.assemble_from_csv(csv_filename)
+    if optimize:
+        intermediate_program = optimizer.optimize_program(intermediate_program, memory_size, word_bits)
+    return intermediate_program, assembler.translate_to_machine_code_bytes(intermediate_program)
+
+
+def _write_output(output_filename, bytecode):
+    """Записывает .bin, только если его содержимое изменилось. Возвращает True при записи."""
+    try:
+        with open(output_filename, 'rb') as f:
+            if f.read() == bytecode:
+                return False
+    except FileNotFoundError:
+        pass
+    _write_atomic(output_filename, bytecode)
+    return True
+
+
+def assemble_cached(csv_filename, output_filename, cache, optimize=False,
+                    memory_size=optimizer.MEMORY_SIZE, word_bits=optimizer.WORD_BITS):
+    """
+    Ассемблирует CSV файл через кэш. Возвращает (попадание в кэш, размер байткода,
+    был ли перезаписан выходной файл). memory_size и word_bits - параметры УВМ для оптимизатора.
+    """
+    key = source_key(csv_filename, optimize, memory_size, word_bits)
+    bytecode = cache.get(key)
+    hit = bytecode is not None
+    if not hit:
+        intermediate_program, bytecode = _assemble(csv_filename, optimize, memory_size, word_bits)
+        cache.put(key, bytecode, intermediate_program)
+    return hit, len(bytecode), _write_output(output_filename, bytecode)
+
+
+def _assemble_job(job):
+    csv_filename, output_filename, cache_dir, max_size, optimize, memory_size, word_bits = job
+    return assemble_cached(csv_filename, output_filename, BuildCache(cache_dir, max_size), optimize,
+                           memory_size, word_bits)
+
+
+def _safe_assemble_job(job):
+    try:
+        return _assemble_job(job)
+    except (OSError, ValueError) as e:
+        return str(e)
+
+
+def assemble_directory(source_dir, output_dir, cache, optimize=False, workers=None,
+                       memory_size=optimizer.MEMORY_SIZE, word_bits=optimizer.WORD_BITS):
+    """
+    Инкрементально ассемблирует все *.csv из source_dir в output_dir/<имя>.bin.
+    Неизменённые файлы берутся из кэша в текущем процессе, изменённые ассемблируются
+    в пуле процессов (workers <= 1 - последовательно). Возвращает {csv файл: результат
+    assemble_cached или текст ошибки}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    misses = []
+    for name in sorted(os.listdir(source_dir)):
+        if not name.endswith(".csv"):
+            continue
+        csv_filename = os.path.join(source_dir, name)
+        output_filename = os.path.join(output_dir, name[:-len(".csv")] + ".bin")
+        bytecode = cache.get(source_key(csv_filename, optimize, memory_size, word_bits))
+        if bytecode is not None:
+            results[csv_filename] = (True, len(bytecode), _write_output(output_filename, bytecode))
+        else:
+            misses.append((csv_filename, output_filename, cache.cache_dir, cache.max_size, optimize,
+                           memory_size, word_bits))
+
+    if (workers is not None and workers <= 1) or len(misses) <= 1:
+        outcomes = map(_safe_assemble_job, misses)
+        for job, outcome in zip(misses, outcomes):
+            results[job[0]] = outcome
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for job, outcome in zip(misses, executor.map(_safe_assemble_job, misses)):
+                results[job[0]] = outcome
+
+    cache.evict()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ассемблирование УВМ Вариант 20 с кэшем по содержимому исходников.")
+    parser.add_argument("source", help="CSV файл или каталог с CSV файлами")
+    parser.add_argument("output", help="Выходной .bin файл или каталог для .bin файлов")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Каталог кэша.")
+    parser.add_argument("--max-size-mb", type=float, default=DEFAULT_MAX_SIZE / (1024 * 1024),
+                        help="Максимальный размер кэша в МБ (давно не использованные записи удаляются).")
+    parser.add_argument("--optimize", action="store_true", help="Оптимизировать программы перед кодированием.")
+    parser.add_argument("--memory-size", type=int, default=optimizer.MEMORY_SIZE,
+                        help="Размер памяти УВМ (в словах), для которой оптимизируются программы.")
+    parser.add_argument("--word-bits", type=int, default=optimizer.WORD_BITS,
+                        help="Ширина слова памяти УВМ, для которой оптимизируются программы.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Количество процессов для каталога (1 - последовательно).")
+
+    args = parser.parse_args()
+    cache = BuildCache(args.cache_dir, int(args.max_size_mb * 1024 * 1024))
+
+    if os.path.isdir(args.source):
+        results = assemble_directory(args.source, args.output, cache, args.optimize, args.workers,
+                                     args.memory_size, args.word_bits)
+    else:
+        try:
+            results = {args.source: assemble_cached(args.source, args.output, cache, args.optimize,
+                                                    args.memory_size, args.word_bits)}
+        except (OSError, ValueError) as e:
+            results = {args.source: str(e)}
+        cache.evict()
+
+    failed = False
+    for csv_filename, outcome in results.items():
+        if isinstance(outcome, str):
+            print(f"{csv_filename}: ошибка: {outcome}")
+            failed = True
+        else:
+            hit, size, written = outcome
+            state = "из кэша" if hit else "ассемблирован"
+            print(f"{csv_filename}: {state}, {size} байт{'' if written else ', без изменений'}")
+    hits = sum(1 for outcome in results.values() if not isinstance(outcome, str) and outcome[0])
+    print(f"Файлов: {len(results)}, из кэша: {hits}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import io
+import os
+import sys
+import json
+import random
+import importlib
+import contextlib
+
+import jit
+import disasm
+from isa import INSTRUCTION_SIZE, OPCODES, OPERAND_BITS, mask
+from interpr import UVM, decode_program, execute, memory_dump, resume
+
+assembler = importlib.import_module("12312312")
+
+# Проверки примеров репозитория (в духе run_tests ассемблера): эталонные дампы памяти
+# при обычном выполнении, со слитыми операциями и через компиляцию, совпадение этих режимов
+# на случайных программах, дизассемблирование с повторным ассемблированием и снимки состояния УВМ.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RANDOM_PROGRAMS = 500 # количество случайных программ в check_fused_equivalence
+RANDOM_SEED = 20
+
+# Программа -> эталонный дамп памяти (начиная с адреса 0).
+SAMPLE_DUMPS = {
+    "stage5_task1": "stage5_task1_dump.json",
+    "stage5_example1": "stage5_ex1_dump.json",
+    "stage5_example2": "stage5_ex2_dump.json",
+    "gt_test": "gt_dump.json",
+    "copy_array_test": "copy_array_dump.json",
+}
+
+
+def _path(name):
+    return os.path.join(BASE_DIR, name)
+
+
+def _read_bytes(name):
+    with open(_path(name), 'rb') as f:
+        return f.read()
+
+
+def check_sample_dumps():
+    """Ассемблирует примеры и сравнивает дампы памяти с эталонными во всех режимах выполнения."""
+    for program, dump_file in SAMPLE_DUMPS.items():
+        bytecode = assembler.translate_to_machine_code_bytes(assembler.assemble_from_csv(_path(program + ".csv")))
+        assert bytecode == _read_bytes(program + ".bin"), f"{program}.csv ассемблируется не в {program}.bin"
+        with open(_path(dump_file), encoding='utf-8') as f:
+            expected = json.load(f)
+        end_addr = max(map(int, expected))
+
+        for label, fuse, use_jit in (("execute", False, False), ("--fuse", True, False), ("--jit", True, True)):
+            vm = UVM()
+            program_decoded = decode_program(bytecode, fuse=fuse)
+            executed = jit.compile_program(program_decoded, vm.memory_size, vm.word_bits).run(vm) if use_jit \
+                else execute(program_decoded, vm)
+            assert executed == len(bytecode) // INSTRUCTION_SIZE, f"{program} ({label}): выполнено {executed} команд"
+            assert memory_dump(vm, 0, end_addr) == expected, f"{program} ({label}): дамп отличается от {dump_file}"
+        print(f"{program}: дампы совпадают с {dump_file} (execute, --fuse, --jit)")
+
+
+def _random_program(rng, size):
+    # Небольшие константы служат адресами; встречаются и адреса вне памяти, и переполнение стека.
+    program = []
+    for _ in range(size):
+        op = rng.choices(("load", "read", "write", "gt"), (5, 1, 2, 2))[0]
+        bits = OPERAND_BITS[OPCODES[op]]
+        program.append({"op": op, "args": [rng.randint(0, min(mask(bits), 40))] if bits else []})
+    return assembler.translate_to_machine_code_bytes(program)
+
+
+def _final_state(bytecode, fuse, use_jit, stack_size):
+    vm = UVM(32, 8, stack_size)
+    program = decode_program(bytecode, fuse=fuse)
+    try:
+        executed = jit.compile_program(program, vm.memory_size, vm.word_bits).run(vm) if use_jit \
+            else execute(program, vm)
+        error = None
+    except RuntimeError as e:
+        executed, error = None, str(e)
+    return bytes(vm.memory), vm.dirty, executed, error
+
+
+def check_fused_equivalence():
+    """
+    Случайные программы дают одинаковые память и ошибки без слитых операций, со слитыми
+    операциями и через компиляцию (в том числе при переполнении маленького стека).
+    """
+    rng = random.Random(RANDOM_SEED)
+    for index in range(RANDOM_PROGRAMS):
+        bytecode = _random_program(rng, rng.randint(0, 40))
+        stack_size = rng.choice((2, 3, 4, 64))
+        reference = _final_state(bytecode, False, False, stack_size)
+        for label, fuse, use_jit in (("--fuse", True, False), ("--jit", False, True), ("--fuse --jit", True, True)):
+            assert _final_state(bytecode, fuse, use_jit, stack_size) == reference, \
+                f"Случайная программа {index} ({label}): результат отличается от выполнения без слитых операций"
+    print(f"Случайные программы ({RANDOM_PROGRAMS}): --fuse и --jit совпадают с обычным выполнением")
+
+
+def check_disassembly_round_trip():
+    """Каждый .bin примеров после дизассемблирования и повторного ассемблирования не меняется."""
+    for name in sorted(os.listdir(BASE_DIR)):
+        if not name.endswith(".bin"):
+            continue
+        bytecode = _read_bytes(name)
+        source = io.StringIO()
+        disasm.write_disassembly(*disasm.decode_words(bytecode), source)
+        source.seek(0)
+        rebuilt = assembler.translate_to_machine_code_bytes(list(assembler.iter_csv_lines(source)))
+        assert rebuilt == bytecode, f"{name}: байткод после дизассемблирования и ассемблирования отличается"
+        print(f"{name}: дизассемблирование -> ассемблирование без изменений")
+
+
+def check_snapshot_round_trip():
+    """Снимок, сделанный посреди выполнения, восстанавливается без потерь и выполнение продолжается."""
+    bytecode = _read_bytes("stage5_task1.bin")
+    reference = UVM()
+    execute(bytecode, reference)
+
+    vm = UVM(word_bits=12, stack_size=64)
+    vm.memory[7] = 4095
+    vm.dirty.add(7)
+    program = decode_program(bytecode, fuse=True)
+    execute(next(program.split(len(program) // 2)), vm)
+
+    restored = UVM.from_snapshot(vm.to_snapshot())
+    for field in ("memory_size", "word_bits", "memory", "stack", "pc", "executed_count", "fused_count", "dirty"):
+        assert getattr(restored, field) == getattr(vm, field), f"Снимок УВМ: поле {field} не восстановлено"
+    assert len(restored.stack_buffer) == len(vm.stack_buffer), "Снимок УВМ: ёмкость стека не восстановлена"
+
+    continued = UVM()
+    execute(next(decode_program(bytecode).split(5)), continued)
+    continued = UVM.from_snapshot(continued.to_snapshot())
+    resume(bytecode, continued)
+    assert continued.memory == reference.memory and continued.pc == reference.pc, \
+        "Выполнение, продолженное со снимка, даёт другой результат"
+    print("Снимок УВМ: to_snapshot -> from_snapshot без потерь, выполнение продолжается со снимка")
+
+
+CHECKS = (check_sample_dumps, check_fused_equivalence, check_disassembly_round_trip, check_snapshot_round_trip)
+
+
+def run_checks():
+    """Выполняет все проверки; возвращает True, если все пройдены."""
+    print("--- Запуск проверок ---")
+    with contextlib.redirect_stdout(io.StringIO()):
+        tests_passed = assembler.run_tests()
+    if not tests_passed:
+        print("Тесты кодирования (run_tests) не пройдены")
+        return False
+    try:
+        for check in CHECKS:
+            # Предупреждения интерпретатора не относятся к результату проверки.
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                check()
+            print(output.getvalue().rstrip())
+    except AssertionError as e:
+        print(f"Проверка не пройдена: {e}")
+        return False
+    print("Все проверки пройдены!")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_checks() else 1)
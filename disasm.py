@@ -0,0 +1,177 @@
+import gc
+import sys
+import json
+import struct
+import argparse
+from array import array
+
+from isa import INSTRUCTION_SIZE, OPCODE_BITS, MNEMONICS, OPERAND_BITS, mask, operand_limits
+from interpr import open_program
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: decode_words работает и без него
+    np = None
+
+DISASM_FORMATS = ("csv", "json", "listing")
+MAX_REPORTED_ERRORS = 20 # количество ошибочных команд, перечисляемых в сообщении об ошибке
+
+
+def _raise_bad_words(bad_indexes, base_index):
+    shown = ", ".join(f"PC {(base_index + i) * INSTRUCTION_SIZE}" for i in bad_indexes[:MAX_REPORTED_ERRORS])
+    more = f" и ещё {len(bad_indexes) - MAX_REPORTED_ERRORS}" if len(bad_indexes) > MAX_REPORTED_ERRORS else ""
+    raise ValueError(f"Неизвестный опкод или лишние биты в поле B у {len(bad_indexes)} команд: {shown}{more}")
+
+
+def _decode_words_numpy(view, count):
+    raw = np.frombuffer(view, dtype=np.uint8, count=count * INSTRUCTION_SIZE).reshape(-1, INSTRUCTION_SIZE)
+    words = raw[:, 0].astype(np.uint32) | (raw[:, 1].astype(np.uint32) << 8) | (raw[:, 2].astype(np.uint32) << 16)
+    opcodes = (words & mask(OPCODE_BITS)).astype(np.uint8)
+    operands = (words >> OPCODE_BITS).astype(np.int64)
+    limits = np.array(operand_limits(), dtype=np.int64)[opcodes]
+    bad = np.flatnonzero((limits < 0) | (operands > limits))
+    return opcodes, operands, bad.tolist()
+
+
+def _decode_words_python(view, count):
+    opcodes = array('B', bytes(count))
+    operands = array('l', [0]) * count
+    opcode_mask = mask(OPCODE_BITS)
+    limits = operand_limits()
+    bad = []
+    for index, (low, high) in enumerate(struct.iter_unpack('<HB', view[:count * INSTRUCTION_SIZE])):
+        word = low | (high << 16)
+        opcode = word & opcode_mask
+        operand = word >> OPCODE_BITS
+        if operand > limits[opcode]: # у неизвестного опкода предел -1
+            bad.append(index)
+        opcodes[index] = opcode
+        operands[index] = operand
+    return opcodes, operands, bad
+
+
+def decode_words(bytecode, start=0, count=None, use_numpy=None):
+    """
+    Декодирует команды байткода за один проход: возвращает столбцы (опкоды, операнды).
+    start и count задают диапазон команд (count=None - до конца байткода).
+    До декодирования проверяется, что длина байткода кратна размеру команды, а после -
+    что все опкоды есть в таблице ISA и у операндов нет битов за пределами поля B;
+    все нарушения сообщаются одной ошибкой ValueError.
+    bytecode - любой буфер (bytes, memoryview, mmap); при наличии NumPy декодирование векторное.
+    """
+    size = len(bytecode)
+    if size % INSTRUCTION_SIZE:
+        tail = size % INSTRUCTION_SIZE
+        raise ValueError(f"Байткод обрезан: {tail} лишних байт в конце (смещение {size - tail})")
+    total = size // INSTRUCTION_SIZE
+    if not 0 <= start <= total:
+        raise ValueError(f"Начальная команда {start} вне программы из {total} команд")
+    count = total - start if count is None else max(0, min(count, total - start))
+
+    if use_numpy is None:
+        use_numpy = np is not None
+    with memoryview(bytecode) as view, view[start * INSTRUCTION_SIZE:(start + count) * INSTRUCTION_SIZE] as body:
+        decode = _decode_words_numpy if use_numpy else _decode_words_python
+        opcodes, operands, bad = decode(body, count)
+    if bad:
+        _raise_bad_words(bad, start)
+    return opcodes, operands
+
+
+def to_intermediate(opcodes, operands):
+    """Промежуточное представление ({"op": ..., "args": [...]}) по столбцам декодированных команд."""
+    names = MNEMONICS
+    with_operand = {opcode for opcode, bits in OPERAND_BITS.items() if bits}
+    # Создаются миллионы словарей без циклических ссылок: сборщик мусора на это время
+    # отключается, иначе его проходы занимают большую часть времени.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return [{"op": names[opcode], "args": [operand] if opcode in with_operand else []}
+                for opcode, operand in zip(opcodes.tolist(), operands.tolist())]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def disassemble(bytecode, start=0, count=None):
+    """Дизассемблирует байткод в промежуточное представление ассемблера."""
+    return to_intermediate(*decode_words(bytecode, start, count))
+
+
+def _csv_lines(opcodes, operands):
+    # Строка CSV ассемблера: "load,267", "write".
+    prefixes = {opcode: f"{name}," if OPERAND_BITS[opcode] else name for opcode, name in MNEMONICS.items()}
+    for opcode, operand in zip(opcodes.tolist(), operands.tolist()):
+        prefix = prefixes[opcode]
+        yield f"{prefix}{operand}" if OPERAND_BITS[opcode] else prefix
+
+
+def _listing_lines(opcodes, operands, start):
+    widths = OPERAND_BITS
+    pc = start * INSTRUCTION_SIZE
+    for opcode, operand in zip(opcodes.tolist(), operands.tolist()):
+        word = opcode | (operand << OPCODE_BITS)
+        raw = " ".join(f"{b:02X}" for b in word.to_bytes(INSTRUCTION_SIZE, "little"))
+        text = f"{MNEMONICS[opcode]} {operand}" if widths[opcode] else MNEMONICS[opcode]
+        yield f"{pc:08d}  {raw}  {text}"
+        pc += INSTRUCTION_SIZE
+
+
+def write_disassembly(opcodes, operands, output, disasm_format="csv", start=0):
+    """
+    Записывает декодированные команды в текстовый поток output: csv - исходный текст ассемблера
+    (повторное ассемблирование даёт тот же байткод), json - промежуточное представление,
+    listing - PC, байты команды и мнемоника.
+    """
+    if disasm_format == "json":
+        json.dump(to_intermediate(opcodes, operands), output, ensure_ascii=False)
+        output.write("\n")
+        return
+    if disasm_format == "csv":
+        lines = _csv_lines(opcodes, operands)
+    elif disasm_format == "listing":
+        lines = _listing_lines(opcodes, operands, start)
+    else:
+        raise ValueError(f"Неизвестный формат дизассемблирования: {disasm_format}")
+    for line in lines:
+        output.write(line)
+        output.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Дизассемблер для УВМ Вариант 20.")
+    parser.add_argument("binary_file", help="Путь к бинарному файлу с ассемблированной программой (.bin)")
+    parser.add_argument("output_file", nargs="?", help="Путь к выходному файлу (по умолчанию - стандартный вывод)")
+    parser.add_argument("--format", choices=DISASM_FORMATS, default="csv",
+                        help="csv - исходный текст ассемблера, json - промежуточное представление, "
+                             "listing - PC, байты и мнемоника.")
+    parser.add_argument("--start", type=int, default=0, help="Номер первой выводимой команды.")
+    parser.add_argument("--count", type=int, default=None, help="Количество выводимых команд (по умолчанию - все).")
+
+    args = parser.parse_args()
+
+    try:
+        with open_program(args.binary_file) as bytecode:
+            opcodes, operands = decode_words(bytecode, args.start, args.count)
+    except FileNotFoundError:
+        print(f"Ошибка: Бинарный файл '{args.binary_file}' не найден.")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+    try:
+        if args.output_file:
+            with open(args.output_file, 'w', newline='', encoding='utf-8') as f:
+                write_disassembly(opcodes, operands, f, args.format, args.start)
+            print(f"Дизассемблировано команд: {len(opcodes)}, результат сохранён в {args.output_file}")
+        else:
+            write_disassembly(opcodes, operands, sys.stdout, args.format, args.start)
+    except OSError as e:
+        print(f"Ошибка при сохранении результата: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,707 @@
+import os
 import sys
+import mmap
+import struct
 import argparse
 import json
+import time
+from contextlib import contextmanager
+from collections import deque
+from array import array
 
-def mask(n):
-    """Возвращает маску из n единиц (2^n - 1).""" # идея из файла преподавателя: создание битовой маски
-    return (1 << n) - 1
+from isa import INSTRUCTION_SIZE, OPCODE_BITS, OPCODES, OPERAND_BITS, MNEMONICS, mask
 
-MEMORY_SIZE = 1024
+MEMORY_SIZE = 1024 # размер памяти по умолчанию (в словах), задаётся параметром UVM / --memory-size
+STACK_SIZE = 4096 # ёмкость стека по умолчанию
+WORD_BITS = OPERAND_BITS[OPCODES["load"]] # ширина слова памяти по умолчанию - ширина константы load
 INITIAL_MEMORY_VALUE = 0
 
+
+def memory_typecode(word_bits):
+    """Возвращает наименьший беззнаковый typecode array, вмещающий слово из word_bits бит."""
+    if word_bits > 0:
+        for typecode in ('B', 'H', 'I', 'L', 'Q'):
+            if array(typecode).itemsize * 8 >= word_bits:
+                return typecode
+    raise ValueError(f"Ширина слова {word_bits} бит не поддерживается")
+
+
 class UVM:
     """
     Модель виртуальной машины.
     Объединённая память для данных. Использует стек для операций.
+    Память - компактный массив array слов заданной ширины, стек - заранее выделенный
+    буфер фиксированной ёмкости с указателем вершины sp.
     """ # идея из файла преподавателя: модель состояния (вместо глобальных переменных reg, mem)
-    def __init__(self, memory_size=MEMORY_SIZE):
-        self.memory = [INITIAL_MEMORY_VALUE] * memory_size
-        self.stack = [] # идея из файла преподавателя: стек для операций (вместо reg)
+    def __init__(self, memory_size=MEMORY_SIZE, word_bits=WORD_BITS, stack_size=STACK_SIZE):
+        self.memory_size = memory_size
+        self.word_bits = word_bits
+        self.word_mask = mask(word_bits)
+        self.memory = array(memory_typecode(word_bits), [INITIAL_MEMORY_VALUE]) * memory_size
+        self.stack_buffer = [0] * stack_size # идея из файла преподавателя: стек для операций (вместо reg)
+        self.sp = 0 # количество элементов в стеке
+        self.pc = 0 # смещение (в байтах) следующей команды программы, с которой продолжится выполнение
+        self.executed_count = 0 # выполнено команд исходной программы
+        self.fused_count = 0 # выполнено слитых операций (суперинструкций)
+        self.dirty = set() # адреса, в которые выполнялась запись (память изначально нулевая)
+
+    @property
+    def stack(self):
+        """Текущее содержимое стека (копия, от дна к вершине)."""
+        return self.stack_buffer[:self.sp]
 
     def push(self, value):
-        self.stack.append(value) # идея из файла преподавателя: операции со стеком/регистром
+        sp = self.sp
+        try:
+            self.stack_buffer[sp] = value # идея из файла преподавателя: операции со стеком/регистром
+        except IndexError:
+            raise RuntimeError("Stack overflow") from None
+        self.sp = sp + 1
 
     def pop(self):
-        if not self.stack:
+        sp = self.sp
+        if not sp:
             raise RuntimeError("Stack underflow")
-        return self.stack.pop() # идея из файла преподавателя: операции со стеком/регистром
+        sp -= 1
+        self.sp = sp
+        return self.stack_buffer[sp] # идея из файла преподавателя: операции со стеком/регистром
 
     def read_memory(self, address):
-        if 0 <= address < len(self.memory):
+        if 0 <= address < self.memory_size:
             return self.memory[address] # идея из файла преподавателя: операции с памятью
         else:
             print(f"Предупреждение: Чтение из недопустимого адреса памяти {address}")
             return 0
 
     def write_memory(self, address, value):
-        if 0 <= address < len(self.memory):
-            self.memory[address] = value # идея из файла преподавателя: операции с памятью
+        if 0 <= address < self.memory_size:
+            self.memory[address] = value & self.word_mask # идея из файла преподавателя: операции с памятью
+            self.dirty.add(address)
         else:
             print(f"Ошибка: Запись в недопустимый адрес памяти {address}")
 
-def execute(bytecode, vm_instance): # идея из файла преподавателя: функция execute
+    def clone(self):
+        """Независимая копия состояния УВМ (память копируется одним блоком)."""
+        copy = UVM.__new__(UVM)
+        copy.__dict__.update(self.__dict__)
+        copy.memory = array(self.memory.typecode, self.memory)
+        copy.stack_buffer = list(self.stack_buffer)
+        copy.dirty = set(self.dirty)
+        return copy
+
+    def to_snapshot(self):
+        """
+        Компактный бинарный снимок полного состояния УВМ: заголовок SNAPSHOT_HEADER,
+        затем содержимое стека, адреса из dirty (по 8 байт) и память (слова Little-Endian).
+        """
+        stack = array('Q', self.stack_buffer[:self.sp])
+        dirty = array('Q', sorted(self.dirty))
+        memory = self.memory
+        if sys.byteorder == 'big':
+            stack, dirty, memory = (array(a.typecode, a) for a in (stack, dirty, memory))
+            for a in (stack, dirty, memory):
+                a.byteswap()
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.word_bits, self.pc, self.sp,
+                                      len(self.stack_buffer), self.memory_size, self.executed_count,
+                                      self.fused_count, len(dirty))
+        return b"".join((header, stack.tobytes(), dirty.tobytes(), memory.tobytes()))
+
+    @classmethod
+    def from_snapshot(cls, data):
+        """Восстанавливает УВМ из снимка to_snapshot (data - bytes, memoryview или mmap)."""
+        with memoryview(data) as view:
+            if len(view) < SNAPSHOT_HEADER.size:
+                raise ValueError("Снимок УВМ повреждён: слишком короткий заголовок")
+            (magic, version, word_bits, pc, sp, stack_size, memory_size,
+             executed_count, fused_count, dirty_count) = SNAPSHOT_HEADER.unpack_from(view)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError("Файл не является снимком УВМ поддерживаемой версии")
+
+            vm = cls(0, word_bits, stack_size)
+            vm.memory_size = memory_size
+            stack, dirty = array('Q'), array('Q')
+            offset = SNAPSHOT_HEADER.size
+            for target, count in ((stack, sp), (dirty, dirty_count), (vm.memory, memory_size)):
+                end = offset + count * target.itemsize
+                if end > len(view):
+                    raise ValueError("Снимок УВМ повреждён: данные обрезаны")
+                target.frombytes(view[offset:end])
+                if sys.byteorder == 'big':
+                    target.byteswap()
+                offset = end
+
+        vm.stack_buffer[:sp] = stack.tolist()
+        vm.sp = sp
+        vm.pc = pc
+        vm.executed_count = executed_count
+        vm.fused_count = fused_count
+        vm.dirty = set(dirty)
+        return vm
+
+
+# Формат снимка: магия, версия, ширина слова, pc, sp, ёмкость стека, размер памяти,
+# счётчики executed_count и fused_count, количество адресов dirty.
+SNAPSHOT_MAGIC = b"UVMS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHBxQQQQQQQ')
+
+
+def save_snapshot(vm_instance, snapshot_file):
+    """Атомарно сохраняет снимок состояния УВМ в файл."""
+    tmp_file = snapshot_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(vm_instance.to_snapshot())
+    os.replace(tmp_file, snapshot_file)
+
+
+def load_snapshot(snapshot_file):
+    """Загружает УВМ из файла снимка."""
+    with open_program(snapshot_file) as data:
+        return UVM.from_snapshot(data)
+
+# Вариант 20: A=1 (load), A=15 (read), A=3 (write), A=5 (gt) - см. таблицу ISA в isa.py
+OP_LOAD = OPCODES["load"]
+OP_WRITE = OPCODES["write"]
+OP_GT = OPCODES["gt"]
+OP_READ = OPCODES["read"]
+
+CONST_BITS = OPERAND_BITS[OP_LOAD]
+CONST_MASK = mask(CONST_BITS)
+
+# Ширина поля B для каждого опкода: 18 бит для load, 6 бит для read/gt, у write поля B нет
+# (у неизвестных опкодов поле B считается 18-битным).
+OPERAND_MASKS = [mask(OPERAND_BITS.get(opcode, CONST_BITS)) for opcode in range(1 << OPCODE_BITS)]
+
+# Слитые операции (суперинструкции). Существуют только в декодированной программе,
+# формат .bin не меняется:
+#   OP_STORE_CONST: load a; load v; write        операнд = a << CONST_BITS | v
+#   OP_READ_CONST:  load a; read k               операнд = a + k
+#   OP_GT_CONST:    load a; load b; load c; gt k операнд = (a + k) << 1 | (b > c)
+# Промежуточные значения на стек не кладутся, но переполнение стека проверяется так же,
+# как у исходных команд: слитой операции нужно FUSED_STACK_DEPTH свободных ячеек стека.
+OP_STORE_CONST = 16
+OP_READ_CONST = 17
+OP_GT_CONST = 18
+HANDLER_COUNT = OP_GT_CONST + 1
+
+# Сколько команд исходной программы заменяет одна операция декодированной программы.
+INSTRUCTION_WIDTHS = [1] * HANDLER_COUNT
+INSTRUCTION_WIDTHS[OP_STORE_CONST] = 3
+INSTRUCTION_WIDTHS[OP_READ_CONST] = 2
+INSTRUCTION_WIDTHS[OP_GT_CONST] = 4
+
+# Максимальная глубина стека, которую занимают исходные команды слитой операции.
+FUSED_STACK_DEPTH = {OP_STORE_CONST: 2, OP_READ_CONST: 1, OP_GT_CONST: 3}
+
+
+class DecodedProgram:
     """
-    Выполняет байткод на виртуальной машине.
+    Предекодированная программа: массив опкодов и массив операндов.
+    Байткод разбирается один раз, цикл интерпретации работает с готовыми полями.
+    """
+    def __init__(self, opcodes, operands, size, instruction_count=None, fused_count=0, base_pc=0):
+        self.opcodes = opcodes # опкоды (поле A) всех команд
+        self.operands = operands # операнды (поле B нужной ширины) всех команд
+        self.size = size # длина исходного байткода в байтах
+        # количество команд исходной программы и число слитых операций среди opcodes
+        self.instruction_count = len(opcodes) if instruction_count is None else instruction_count
+        self.fused_count = fused_count
+        self.base_pc = base_pc # смещение первой команды в исходном байткоде
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def split(self, steps):
+        """Делит программу на последовательные части не более чем по steps операций."""
+        widths = INSTRUCTION_WIDTHS
+        base_pc = self.base_pc
+        for start in range(0, len(self.opcodes), steps):
+            opcodes = self.opcodes[start:start + steps]
+            instruction_count = sum(widths[opcode] for opcode in opcodes)
+            end_pc = base_pc + instruction_count * INSTRUCTION_SIZE
+            last = start + steps >= len(self.opcodes)
+            yield DecodedProgram(opcodes, self.operands[start:start + steps],
+                                 self.size if last else end_pc, instruction_count,
+                                 sum(1 for opcode in opcodes if opcode >= OP_STORE_CONST), base_pc)
+            base_pc = end_pc
+
+
+def decode_program(bytecode, fuse=False, start_pc=0):
+    """
+    Декодирует весь байткод (начиная со смещения start_pc) в DecodedProgram за один проход.
+    При fuse типовые последовательности команд заменяются слитыми операциями (см. fuse_program).
+    bytecode - любой буфер (bytes, memoryview, mmap): команды читаются через memoryview
+    без копирования каждой команды в отдельный объект bytes.
+    Неполная команда в конце байткода отбрасывается (о ней сообщает execute).
+    """
+    size = len(bytecode)
+    count = max(size - start_pc, 0) // INSTRUCTION_SIZE
+    opcodes = array('B', bytes(count))
+    operands = array('l', [0]) * count
+    opcode_mask = mask(OPCODE_BITS)
+    operand_masks = OPERAND_MASKS
+
+    with memoryview(bytecode) as view, view[start_pc:start_pc + count * INSTRUCTION_SIZE] as body:
+        # Команда - 3 байта Little-Endian: младшие 16 бит и старший байт.
+        for index, (low, high) in enumerate(struct.iter_unpack('<HB', body)):
+            cmd_int = low | (high << 16)
+            opcode = cmd_int & opcode_mask
+            opcodes[index] = opcode
+            operands[index] = (cmd_int >> OPCODE_BITS) & operand_masks[opcode]
+
+    program = DecodedProgram(opcodes, operands, size, base_pc=start_pc)
+    return fuse_program(program) if fuse else program
+
+
+def fuse_program(program):
+    """
+    Заменяет в декодированной программе последовательности load a; load b; load c; gt k,
+    load a; load v; write и load a; read k слитыми операциями, которые выполняются
+    за один шаг цикла без промежуточных операций со стеком.
+    """
+    opcodes = program.opcodes
+    operands = program.operands
+    fused_opcodes = array('B')
+    fused_operands = array('q') # операнд OP_STORE_CONST занимает до 36 бит
+    emit_opcode = fused_opcodes.append
+    emit_operand = fused_operands.append
+    count = len(opcodes)
+    fused = 0
+    i = 0
+
+    while i < count:
+        opcode = opcodes[i]
+        if opcode == OP_LOAD and i + 1 < count:
+            following = opcodes[i + 1]
+            if following == OP_READ:
+                emit_opcode(OP_READ_CONST)
+                emit_operand(operands[i] + operands[i + 1])
+                fused += 1
+                i += 2
+                continue
+            if following == OP_LOAD and i + 2 < count:
+                third = opcodes[i + 2]
+                if third == OP_WRITE:
+                    emit_opcode(OP_STORE_CONST)
+                    emit_operand(operands[i] << CONST_BITS | operands[i + 1])
+                    fused += 1
+                    i += 3
+                    continue
+                if third == OP_LOAD and i + 3 < count and opcodes[i + 3] == OP_GT:
+                    emit_opcode(OP_GT_CONST)
+                    emit_operand((operands[i] + operands[i + 3]) << 1 | (operands[i + 1] > operands[i + 2]))
+                    fused += 1
+                    i += 4
+                    continue
+        emit_opcode(opcode)
+        emit_operand(operands[i])
+        i += 1
+
+    return DecodedProgram(fused_opcodes, fused_operands, program.size,
+                          instruction_count=program.instruction_count, fused_count=program.fused_count + fused,
+                          base_pc=program.base_pc)
+
+
+@contextmanager
+def open_program(path, use_mmap=True):
+    """
+    Открывает бинарный файл программы и возвращает буфер с его содержимым.
+    При use_mmap файл отображается в память только для чтения (страницы общие для всех
+    процессов, читающих тот же файл), и возвращается memoryview на отображение.
+    Буфер действителен только внутри блока with.
+    """
+    with open(path, 'rb') as f: # идея из файла преподавателя: чтение бинарного файла
+        if not use_mmap or os.fstat(f.fileno()).st_size == 0: # пустой файл нельзя отобразить в память
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def _exec_load(vm_instance, const_val, pc): # load: A=1, B=const_val (18 бит)
+    vm_instance.push(const_val) # идея из файла преподавателя: операции с памятью/регистром/стеком
+    print(f"PC: {pc}, Выполнена: load {const_val}. Стек: {vm_instance.stack}")
+
+
+def _exec_read(vm_instance, offset_val, pc): # read: A=15, B=offset_val (6 бит)
+    addr = vm_instance.pop()
+    effective_addr = addr + offset_val
+    value = vm_instance.read_memory(effective_addr)
+    vm_instance.push(value)
+    print(f"PC: {pc}, Выполнена: read {offset_val}. Адрес: {addr}, Смещение: {offset_val}, Эфф. адрес: {effective_addr}, Значение: {value}. Стек: {vm_instance.stack}")
+
+
+def _exec_write(vm_instance, _operand, pc): # write: A=3
+    value = vm_instance.pop()
+    addr = vm_instance.pop()
+    vm_instance.write_memory(addr, value)
+    print(f"PC: {pc}, Выполнена: write. Адрес: {addr}, Значение: {value}. Стек: {vm_instance.stack}")
+
+
+def _exec_gt(vm_instance, offset_val, pc): # gt: A=5, B=offset_val (6 бит)
+    # Согласно спецификации: val1 (снятый первым), val2 (снятый вторым), addr (снятый третьим)
+    # Результат (1 или 0) записывается в mem[addr + offset_val]
+    val1 = vm_instance.pop()
+    val2 = vm_instance.pop()
+    addr = vm_instance.pop()
+    effective_addr = addr + offset_val
+    result = 1 if val2 > val1 else 0
+    vm_instance.write_memory(effective_addr, result)
+    print(f"PC: {pc}, Выполнена: gt {offset_val}. Val2: {val2}, Val1: {val1}, Addr: {addr}, Смещение: {offset_val}, Эфф. адрес: {effective_addr}, Результат: {result}. Memory[{effective_addr}] = {result}. Стек: {vm_instance.stack}")
+
+
+def _exec_store_const(vm_instance, operand, pc): # load a; load v; write
+    if vm_instance.sp + 2 > len(vm_instance.stack_buffer):
+        raise RuntimeError("Stack overflow")
+    addr, value = operand >> CONST_BITS, operand & CONST_MASK
+    vm_instance.write_memory(addr, value)
+    print(f"PC: {pc}, Выполнена: load {addr}; load {value}; write (слитая). Адрес: {addr}, Значение: {value}. Стек: {vm_instance.stack}")
+
+
+def _exec_read_const(vm_instance, effective_addr, pc): # load a; read k
+    value = vm_instance.read_memory(effective_addr)
+    vm_instance.push(value)
+    print(f"PC: {pc}, Выполнена: load; read (слитая). Эфф. адрес: {effective_addr}, Значение: {value}. Стек: {vm_instance.stack}")
+
+
+def _exec_gt_const(vm_instance, operand, pc): # load a; load b; load c; gt k
+    if vm_instance.sp + 3 > len(vm_instance.stack_buffer):
+        raise RuntimeError("Stack overflow")
+    effective_addr, result = operand >> 1, operand & 1
+    vm_instance.write_memory(effective_addr, result)
+    print(f"PC: {pc}, Выполнена: load; load; load; gt (слитая). Эфф. адрес: {effective_addr}, Результат: {result}. Memory[{effective_addr}] = {result}. Стек: {vm_instance.stack}")
+
+
+def _load(vm_instance, const_val):
+    vm_instance.push(const_val)
+
+
+def _read(vm_instance, offset_val):
+    vm_instance.push(vm_instance.read_memory(vm_instance.pop() + offset_val))
+
+
+def _write(vm_instance, _operand):
+    value = vm_instance.pop()
+    vm_instance.write_memory(vm_instance.pop(), value)
+
+
+def _gt(vm_instance, offset_val):
+    val1 = vm_instance.pop()
+    val2 = vm_instance.pop()
+    vm_instance.write_memory(vm_instance.pop() + offset_val, 1 if val2 > val1 else 0)
+
+
+def _store_const(vm_instance, operand):
+    if vm_instance.sp + 2 > len(vm_instance.stack_buffer):
+        raise RuntimeError("Stack overflow")
+    vm_instance.write_memory(operand >> CONST_BITS, operand & CONST_MASK)
+
+
+def _read_const(vm_instance, effective_addr):
+    vm_instance.push(vm_instance.read_memory(effective_addr))
+
+
+def _gt_const(vm_instance, operand):
+    if vm_instance.sp + 3 > len(vm_instance.stack_buffer):
+        raise RuntimeError("Stack overflow")
+    vm_instance.write_memory(operand >> 1, operand & 1)
+
+
+# Таблицы диспетчеризации: индекс - опкод, None - неизвестный опкод.
+# QUIET_HANDLERS выполняют команду без какого-либо форматирования вывода,
+# VERBOSE_HANDLERS дополнительно печатают каждый шаг вместе со стеком.
+QUIET_HANDLERS = [None] * HANDLER_COUNT
+QUIET_HANDLERS[OP_LOAD] = _load
+QUIET_HANDLERS[OP_READ] = _read
+QUIET_HANDLERS[OP_WRITE] = _write
+QUIET_HANDLERS[OP_GT] = _gt
+QUIET_HANDLERS[OP_STORE_CONST] = _store_const
+QUIET_HANDLERS[OP_READ_CONST] = _read_const
+QUIET_HANDLERS[OP_GT_CONST] = _gt_const
+
+VERBOSE_HANDLERS = [None] * HANDLER_COUNT
+VERBOSE_HANDLERS[OP_LOAD] = _exec_load
+VERBOSE_HANDLERS[OP_READ] = _exec_read
+VERBOSE_HANDLERS[OP_WRITE] = _exec_write
+VERBOSE_HANDLERS[OP_GT] = _exec_gt
+VERBOSE_HANDLERS[OP_STORE_CONST] = _exec_store_const
+VERBOSE_HANDLERS[OP_READ_CONST] = _exec_read_const
+VERBOSE_HANDLERS[OP_GT_CONST] = _exec_gt_const
+
+OPCODE_NAMES = MNEMONICS
+
+
+def format_instruction(opcode, operand):
+    """Текстовое представление операции декодированной программы (для трассировки)."""
+    if opcode == OP_WRITE:
+        return "write"
+    if opcode in OPCODE_NAMES:
+        return f"{OPCODE_NAMES[opcode]} {operand}"
+    if opcode == OP_STORE_CONST:
+        return f"load {operand >> CONST_BITS}; load {operand & CONST_MASK}; write"
+    if opcode == OP_READ_CONST:
+        return f"load; read [{operand}]"
+    if opcode == OP_GT_CONST:
+        return f"load; load; load; gt [{operand >> 1}] = {operand & 1}"
+    return f"opcode {opcode} {operand}"
+
+# Режимы выполнения:
+#   quiet   - без вывода на каждом шаге (по умолчанию);
+#   trace   - последние trace_size шагов хранятся в кольцевом буфере и печатаются при ошибке;
+#   verbose - печать каждого шага со стеком (прежнее поведение).
+EXECUTION_MODES = ("quiet", "trace", "verbose")
+DEFAULT_TRACE_SIZE = 64
+
+
+def _executed_instructions(program, steps):
+    """Количество команд исходной программы в первых steps операциях декодированной программы."""
+    if steps == len(program):
+        return program.instruction_count
+    widths = INSTRUCTION_WIDTHS
+    return sum(widths[opcode] for opcode in program.opcodes[:steps])
+
+
+def _run_quiet(program, vm_instance):
+    handlers = QUIET_HANDLERS
+    steps = 0
+    for opcode, operand in zip(program.opcodes, program.operands):
+        handler = handlers[opcode]
+        if handler is None:
+            pc = program.base_pc + _executed_instructions(program, steps) * INSTRUCTION_SIZE
+            print(f"Ошибка: Неизвестный опкод {opcode} на PC {pc}")
+            break # Прерываем выполнение при ошибке
+        handler(vm_instance, operand)
+        steps += 1
+    return steps
+
+
+def _run_verbose(program, vm_instance):
+    handlers = VERBOSE_HANDLERS
+    widths = INSTRUCTION_WIDTHS
+    pc = program.base_pc # идея из файла преподавателя: счётчик команд
+    steps = 0
+    for opcode, operand in zip(program.opcodes, program.operands):
+        handler = handlers[opcode]
+        if handler is None:
+            print(f"Ошибка: Неизвестный опкод {opcode} на PC {pc}")
+            break
+        handler(vm_instance, operand, pc)
+        pc += widths[opcode] * INSTRUCTION_SIZE
+        steps += 1
+    return steps
+
+
+def _print_trace(trace, vm_instance):
+    print(f"--- Последние {len(trace)} шагов ---")
+    for pc, opcode, operand in trace:
+        print(f"PC: {pc}, {format_instruction(opcode, operand)}")
+    print(f"Стек: {vm_instance.stack}")
+
+
+def _run_trace(program, vm_instance, trace_size):
+    handlers = QUIET_HANDLERS
+    widths = INSTRUCTION_WIDTHS
+    trace = deque(maxlen=trace_size)
+    record = trace.append
+    pc = program.base_pc
+    steps = 0
+    try:
+        for opcode, operand in zip(program.opcodes, program.operands):
+            record((pc, opcode, operand))
+            handler = handlers[opcode]
+            if handler is None:
+                print(f"Ошибка: Неизвестный опкод {opcode} на PC {pc}")
+                _print_trace(trace, vm_instance)
+                break
+            handler(vm_instance, operand)
+            pc += widths[opcode] * INSTRUCTION_SIZE
+            steps += 1
+    except Exception as e:
+        print(f"Ошибка на PC {pc}: {e}")
+        _print_trace(trace, vm_instance)
+        raise
+    return steps
+
+
+class ExecutionHook:
     """
-    pc = 0 # идея из файла преподавателя: счётчик команд
-    print("Запуск цикла интерпретации...")
+    Базовый класс хуков инструментирования execute. Хуки вызываются только в отдельном
+    цикле, который выбирается при передаче hooks; без хуков цикл диспетчеризации не меняется.
+    """
+    def on_start(self, program, vm_instance):
+        pass
+
+    def on_step(self, pc, opcode, operand, vm_instance):
+        """Вызывается перед выполнением операции (состояние стека - до операции)."""
+
+    def after_step(self, pc, opcode, operand, elapsed, vm_instance):
+        """Вызывается после выполнения операции; elapsed - время обработчика в секундах."""
+
+    def on_end(self, vm_instance):
+        pass
 
-    while pc < len(bytecode): # идея из файла преподавателя: цикл по байткоду
-        # --- ЧТЕНИЕ КОМАНДЫ ---
-        if pc + 2 >= len(bytecode):
-            print(f"Предупреждение: Достигнут конец байткода на PC {pc}, остановка.")
+
+def _run_hooked(program, vm_instance, hooks):
+    handlers = QUIET_HANDLERS
+    widths = INSTRUCTION_WIDTHS
+    clock = time.perf_counter
+    pc = program.base_pc
+    steps = 0
+    for opcode, operand in zip(program.opcodes, program.operands):
+        handler = handlers[opcode]
+        if handler is None:
+            print(f"Ошибка: Неизвестный опкод {opcode} на PC {pc}")
             break
+        for hook in hooks:
+            hook.on_step(pc, opcode, operand, vm_instance)
+        start = clock()
+        handler(vm_instance, operand)
+        elapsed = clock() - start
+        for hook in hooks:
+            hook.after_step(pc, opcode, operand, elapsed, vm_instance)
+        pc += widths[opcode] * INSTRUCTION_SIZE
+        steps += 1
+    return steps
+
 
-        cmd_bytes = bytecode[pc:pc+3] # идея из файла преподавателя: чтение байтов команды
-        cmd_int = int.from_bytes(cmd_bytes, 'little') # идея из файла преподавателя: преобразование байтов в int
-
-        # --- ИЗВЛЕЧЕНИЕ ПОЛЕЙ КОМАНДЫ (A и B) ---
-        # Вариант 20: A (биты 0-3), B (биты 4-21 для load/gt, 4-9 для read)
-        A_OPCODE = cmd_int & mask(4) # идея из файла преподавателя: извлечение битов с помощью маски и &
-        # B_VALUE используется для load (18 бит) и gt (6 бит)
-        B_VALUE = (cmd_int >> 4) & mask(18) # идея из файла преподавателя: сдвиг и извлечение битов
-        # B_OFFSET используется для read (6 бит) и gt (6 бит)
-        B_OFFSET = (cmd_int >> 4) & mask(6) # идея из файла преподавателя: сдвиг и извлечение битов
-
-        # Вариант 20: A=1 (load), A=15 (read), A=3 (write), A=5 (gt)
-        if A_OPCODE == 1: # load: A=1, B=const_val (18 бит)
-            const_val = B_VALUE
-            vm_instance.push(const_val) # идея из файла преподавателя: операции с памятью/регистром/стеком
-            print(f"PC: {pc}, Выполнена: load {const_val}. Стек: {vm_instance.stack}")
-            pc += 3
-        elif A_OPCODE == 15: # read: A=15, B=offset_val (6 бит)
-            offset_val = B_OFFSET
-            addr = vm_instance.pop() # идея из файла преподавателя: операции с памятью/регистром/стеком
-            effective_addr = addr + offset_val
-            value = vm_instance.read_memory(effective_addr) # идея из файла преподавателя: операции с памятью/регистром/стеком
-            vm_instance.push(value) # идея из файла преподавателя: операции с памятью/регистром/стеком
-            print(f"PC: {pc}, Выполнена: read {offset_val}. Адрес: {addr}, Смещение: {offset_val}, Эфф. адрес: {effective_addr}, Значение: {value}. Стек: {vm_instance.stack}")
-            pc += 3
-        elif A_OPCODE == 3: # write: A=3
-            value = vm_instance.pop() # идея из файла преподавателя: операции с памятью/регистром/стеком
-            addr = vm_instance.pop() # идея из файла преподавателя: операции с памятью/регистром/стеком
-            vm_instance.write_memory(addr, value) # идея из файла преподавателя: операции с памятью/регистром/стеком
-            print(f"PC: {pc}, Выполнена: write. Адрес: {addr}, Значение: {value}. Стек: {vm_instance.stack}")
-            pc += 3
-        elif A_OPCODE == 5: # gt: A=5, B=offset_val (6 бит) - Реализуем для полноты спецификации, хотя Этап 3 требует load, read, write
-            # Согласно спецификации: val1 (снятый первым), val2 (снятый вторым), addr (снятый третьим)
-            # Результат (1 или 0) записывается в mem[addr + offset_val]
-            offset_val = B_OFFSET
-            val1 = vm_instance.pop() # идея из файла преподавателя: операции с памятью/регистром/стеком
-            val2 = vm_instance.pop() # идея из файла преподавателя: операции с памятью/регистром/стеком
-            addr = vm_instance.pop() # идея из файла преподавателя: операции с памятью/регистром/стеком
-            effective_addr = addr + offset_val
-            result = 1 if val2 > val1 else 0 # идея из файла преподавателя: операции с памятью/регистром/стеком
-            vm_instance.write_memory(effective_addr, result) # идея из файла преподавателя: операции с памятью/регистром/стеком
-            print(f"PC: {pc}, Выполнена: gt {offset_val}. Val2: {val2}, Val1: {val1}, Addr: {addr}, Смещение: {offset_val}, Эфф. адрес: {effective_addr}, Результат: {result}. Memory[{effective_addr}] = {result}. Стек: {vm_instance.stack}")
-            pc += 3
+def execute(bytecode, vm_instance, mode="quiet", trace_size=DEFAULT_TRACE_SIZE, hooks=None): # идея из файла преподавателя: функция execute
+    """
+    Выполняет байткод на виртуальной машине.
+    Принимает байткод или уже декодированную программу (DecodedProgram, в том числе
+    со слитыми операциями). mode - один из EXECUTION_MODES.
+    Возвращает количество выполненных команд исходной программы; счётчики
+    executed_count и fused_count УВМ увеличиваются соответственно, pc УВМ указывает
+    на следующую невыполненную команду.
+    hooks - список ExecutionHook (только для режима quiet).
+    """
+    program = bytecode if isinstance(bytecode, DecodedProgram) else decode_program(bytecode)
+    verbose = mode == "verbose"
+    if hooks and mode != "quiet":
+        raise ValueError("Хуки выполнения поддерживаются только в режиме quiet")
+    if verbose:
+        print("Запуск цикла интерпретации...")
+
+    if hooks:
+        for hook in hooks:
+            hook.on_start(program, vm_instance)
+        try:
+            steps = _run_hooked(program, vm_instance, hooks)
+        finally:
+            for hook in hooks:
+                hook.on_end(vm_instance)
+    elif mode == "quiet":
+        steps = _run_quiet(program, vm_instance)
+    elif mode == "trace":
+        steps = _run_trace(program, vm_instance, trace_size)
+    elif verbose:
+        steps = _run_verbose(program, vm_instance)
+    else:
+        raise ValueError(f"Неизвестный режим выполнения: {mode}")
+
+    executed = _executed_instructions(program, steps)
+    end_pc = program.base_pc + executed * INSTRUCTION_SIZE
+    if steps == len(program):
+        vm_instance.fused_count += program.fused_count
+        if end_pc < program.size:
+            print(f"Предупреждение: Достигнут конец байткода на PC {end_pc}, остановка.")
+    else:
+        vm_instance.fused_count += sum(1 for opcode in program.opcodes[:steps] if opcode >= OP_STORE_CONST)
+    vm_instance.executed_count += executed
+    vm_instance.pc = end_pc
+
+    if verbose:
+        print("Цикл интерпретации завершён.")
+    return executed
+
+
+def execute_with_checkpoints(program, vm_instance, snapshot_file, checkpoint_steps, mode="quiet"):
+    """
+    Выполняет декодированную программу частями по checkpoint_steps операций и после каждой
+    части сохраняет снимок состояния УВМ в snapshot_file (последний снимок - итоговое состояние).
+    Возвращает количество выполненных команд исходной программы. Режим trace не поддерживается:
+    кольцевой буфер шагов не переносится между частями.
+    """
+    if mode not in ("quiet", "verbose"):
+        raise ValueError(f"Режим выполнения {mode} не поддерживается при сохранении снимков по ходу выполнения")
+    executed = 0
+    for part in program.split(checkpoint_steps):
+        part_executed = execute(part, vm_instance, mode=mode)
+        executed += part_executed
+        save_snapshot(vm_instance, snapshot_file)
+        if part_executed < part.instruction_count:
+            break # выполнение остановлено ошибкой
+    else:
+        if not len(program):
+            save_snapshot(vm_instance, snapshot_file)
+    return executed
+
+
+def resume(bytecode, vm_instance, fuse=False, mode="quiet"):
+    """Продолжает выполнение байткода на УВМ (например, восстановленной из снимка) с vm_instance.pc."""
+    return execute(decode_program(bytecode, fuse=fuse, start_pc=vm_instance.pc), vm_instance, mode=mode)
+
+
+def memory_dump(vm_instance, start_addr, end_addr):
+    """Возвращает словарь {адрес (строкой): значение} для диапазона памяти [start_addr, end_addr]."""
+    memory = vm_instance.memory
+    return {str(addr): memory[addr] # идея из файла преподавателя: цикл по памяти для дампа
+            for addr in range(start_addr, min(end_addr + 1, len(memory)))}
+
+
+def sparse_memory_dump(vm_instance, start_addr, end_addr):
+    """
+    Как memory_dump, но только для ячеек диапазона, в которые выполнялась запись.
+    Память изначально нулевая, поэтому все ненулевые ячейки попадают в дамп.
+    """
+    memory = vm_instance.memory
+    return {str(addr): memory[addr]
+            for addr in sorted(vm_instance.dirty) if start_addr <= addr <= end_addr}
+
+
+# Форматы дампа памяти:
+#   json   - {адрес: значение} для всего диапазона (прежний формат);
+#   sparse - JSON только с ячейками, в которые выполнялась запись;
+#   stream - тот же JSON, что и json, но записывается порциями без построения словаря;
+#   binary - слова памяти в машинном порядке байт (array.tofile), по itemsize байт на слово.
+DUMP_FORMATS = ("json", "sparse", "stream", "binary")
+DUMP_CHUNK_SIZE = 4096 # количество ячеек в одной порции потокового дампа
+
+
+def _stream_json_dump(memory, start_addr, end_addr, f):
+    """Записывает дамп в том же виде, что json.dump(..., indent=2), не строя словарь целиком."""
+    if start_addr > end_addr:
+        f.write("{}")
+        return
+    f.write("{\n")
+    for chunk_start in range(start_addr, end_addr + 1, DUMP_CHUNK_SIZE):
+        chunk_end = min(chunk_start + DUMP_CHUNK_SIZE, end_addr + 1)
+        f.write(",\n".join(f'  "{addr}": {memory[addr]}' for addr in range(chunk_start, chunk_end)))
+        f.write(",\n" if chunk_end <= end_addr else "\n")
+    f.write("}")
+
+
+def write_memory_dump(vm_instance, dump_file, start_addr, end_addr, dump_format="json"):
+    """Сохраняет диапазон памяти [start_addr, end_addr] в файл в одном из форматов DUMP_FORMATS."""
+    end_addr = min(end_addr, len(vm_instance.memory) - 1)
+    if dump_format == "binary":
+        with open(dump_file, 'wb') as f:
+            vm_instance.memory[start_addr:end_addr + 1].tofile(f)
+        return
+
+    with open(dump_file, 'w', encoding='utf-8') as f:
+        if dump_format == "json":
+            json.dump(memory_dump(vm_instance, start_addr, end_addr), f, indent=2, ensure_ascii=False)
+        elif dump_format == "sparse":
+            json.dump(sparse_memory_dump(vm_instance, start_addr, end_addr), f, indent=2, ensure_ascii=False)
+        elif dump_format == "stream":
+            _stream_json_dump(vm_instance.memory, start_addr, end_addr, f)
         else:
-            print(f"Ошибка: Неизвестный опкод {A_OPCODE} на PC {pc}")
-            break # Прерываем выполнение при ошибке
+            raise ValueError(f"Неизвестный формат дампа: {dump_format}")
 
-    print("Цикл интерпретации завершён.")
 
 def main():
     parser = argparse.ArgumentParser(description="Интерпретатор для УВМ Вариант 20 (Этап 3).") # идея из файла преподавателя: CLI (хотя он читал файл напрямую)
@@ -107,36 +709,129 @@ def main():
     parser.add_argument("dump_file", help="Путь к файлу для сохранения дампа памяти (.json)")
     parser.add_argument("start_addr", type=int, help="Начальный адрес для диапазона дампа памяти")
     parser.add_argument("end_addr", type=int, help="Конечный адрес для диапазона дампа памяти")
+    parser.add_argument("--dump-format", choices=DUMP_FORMATS, default="json",
+                        help="Формат дампа: json - весь диапазон, sparse - только записанные ячейки, "
+                             "stream - json с потоковой записью, binary - сырые слова памяти.")
+    parser.add_argument("--memory-size", type=int, default=MEMORY_SIZE,
+                        help="Размер памяти УВМ в словах.")
+    parser.add_argument("--word-bits", type=int, default=WORD_BITS,
+                        help="Ширина слова памяти в битах.")
+    parser.add_argument("--stack-size", type=int, default=STACK_SIZE,
+                        help="Ёмкость стека УВМ.")
+    parser.add_argument("--no-mmap", action="store_true",
+                        help="Читать бинарный файл целиком вместо отображения в память (mmap).")
+    parser.add_argument("--fuse", action="store_true",
+                        help="Выполнять типовые последовательности команд как слитые операции (суперинструкции).")
+    parser.add_argument("--profile", metavar="REPORT_FILE",
+                        help="Собрать профиль выполнения (счётчики и время по опкодам, горячие PC, "
+                             "глубина стека, карты обращений к памяти) и сохранить его в JSON.")
+    parser.add_argument("--jit", action="store_true",
+                        help="Компилировать программу в функции Python (кэшируются по хэшу программы) и выполнять их.")
+    parser.add_argument("--jit-verify", action="store_true",
+                        help="Как --jit, но дополнительно сравнить результат с эталонным интерпретатором.")
+    parser.add_argument("--checkpoint", metavar="SNAPSHOT_FILE",
+                        help="Сохранить снимок состояния УВМ (pc, стек, память, счётчики) после выполнения.")
+    parser.add_argument("--checkpoint-every", type=int, metavar="N",
+                        help="Сохранять снимок в --checkpoint каждые N шагов выполнения.")
+    parser.add_argument("--resume", metavar="SNAPSHOT_FILE",
+                        help="Продолжить выполнение с состояния из снимка (параметры памяти берутся из снимка).")
+    parser.add_argument("--mode", choices=EXECUTION_MODES, default="quiet",
+                        help="Режим выполнения: quiet - без трассировки, trace - кольцевой буфер последних шагов "
+                             "(печатается при ошибке), verbose - печать каждого шага.")
+    parser.add_argument("--trace-size", type=int, default=DEFAULT_TRACE_SIZE,
+                        help="Количество шагов, хранимых в режиме trace.")
 
     args = parser.parse_args()
 
+    if args.profile and (args.mode != "quiet" or args.checkpoint_every):
+        print("Ошибка: Профилирование поддерживается только в режиме quiet и без --checkpoint-every.")
+        sys.exit(1)
+    if (args.jit or args.jit_verify) and (args.mode != "quiet" or args.profile or args.checkpoint_every):
+        print("Ошибка: --jit поддерживается только в режиме quiet, без профилирования и --checkpoint-every.")
+        sys.exit(1)
+    if args.mode == "trace" and args.checkpoint_every:
+        print("Ошибка: Режим trace не поддерживается вместе с --checkpoint-every.")
+        sys.exit(1)
+    if args.checkpoint_every is not None and (args.checkpoint_every <= 0 or not args.checkpoint):
+        print("Ошибка: --checkpoint-every требует положительного значения и --checkpoint.")
+        sys.exit(1)
+
+    if args.resume:
+        print(f"Восстановление состояния УВМ из снимка {args.resume}")
+        try:
+            vm = load_snapshot(args.resume)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка при загрузке снимка: {e}")
+            sys.exit(1)
+    else:
+        print(f"Инициализация памяти УВМ (размер: {args.memory_size}) и стека.")
+        try:
+            vm = UVM(args.memory_size, args.word_bits, args.stack_size) # идея из файла преподавателя: инициализация состояния (вместо глобальных переменных)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+
     # Проверка корректности диапазона
-    if args.start_addr < 0 or args.end_addr < args.start_addr or args.end_addr >= MEMORY_SIZE:
-        print(f"Ошибка: Неверный диапазон памяти [{args.start_addr}, {args.end_addr}]. Должно быть 0 <= start <= end < {MEMORY_SIZE}.")
+    if args.start_addr < 0 or args.end_addr < args.start_addr or args.end_addr >= vm.memory_size:
+        print(f"Ошибка: Неверный диапазон памяти [{args.start_addr}, {args.end_addr}]. Должно быть 0 <= start <= end < {vm.memory_size}.")
         sys.exit(1)
 
+    decoder = decode_program
+    if args.jit or args.jit_verify:
+        # jit импортирует модуль interpr (при запуске скрипта это не __main__),
+        # поэтому программа декодируется в классы этого модуля
+        import jit
+        decoder = jit.decode_program
+
     print(f"Загрузка программы из {args.binary_file}")
     try:
-        with open(args.binary_file, 'rb') as f: # идея из файла преподавателя: чтение бинарного файла
-            bytecode = f.read()
+        with open_program(args.binary_file, use_mmap=not args.no_mmap) as bytecode:
+            program = decoder(bytecode, fuse=args.fuse, start_pc=vm.pc)
     except FileNotFoundError:
         print(f"Ошибка: Бинарный файл '{args.binary_file}' не найден.")
         sys.exit(1)
 
-    print(f"Инициализация памяти УВМ (размер: {MEMORY_SIZE}) и стека.")
-    vm = UVM() # идея из файла преподавателя: инициализация состояния (вместо глобальных переменных)
+    hooks = None
+    if args.profile:
+        from profiler import Profiler # profiler сам импортирует interpr
+        profiler = Profiler()
+        hooks = [profiler]
 
-    execute(bytecode, vm) # идея из файла преподавателя: вызов основной функции выполнения
+    if args.jit or args.jit_verify:
+        if args.jit_verify:
+            try:
+                executed, vm = jit.verify_jit(program, vm)
+            except AssertionError as e:
+                print(f"Ошибка проверки скомпилированной программы: {e}")
+                sys.exit(1)
+            print("Проверка: результат скомпилированной программы совпадает с интерпретатором.")
+        else:
+            executed = jit.execute_jit(program, vm)
+        if args.checkpoint:
+            save_snapshot(vm, args.checkpoint)
+    elif args.checkpoint_every:
+        executed = execute_with_checkpoints(program, vm, args.checkpoint, args.checkpoint_every, mode=args.mode)
+    else:
+        executed = execute(program, vm, mode=args.mode, trace_size=args.trace_size, hooks=hooks) # идея из файла преподавателя: вызов основной функции выполнения
+        if args.checkpoint:
+            save_snapshot(vm, args.checkpoint)
+    print(f"Выполнено команд: {executed}")
+    if args.checkpoint:
+        print(f"Снимок состояния УВМ (PC: {vm.pc}) сохранён в {args.checkpoint}")
+    if args.profile:
+        try:
+            profiler.save_report(args.profile)
+            print(f"Профиль выполнения сохранён в {args.profile}")
+        except OSError as e:
+            print(f"Ошибка при сохранении профиля: {e}")
+            sys.exit(1)
+    if args.fuse:
+        print(f"Выполнено слитых операций: {vm.fused_count}")
 
-    # Формирование дампа памяти в JSON # идея из файла преподавателя: вывод результата (хотя он просто печатал)
+    # Формирование дампа памяти # идея из файла преподавателя: вывод результата (хотя он просто печатал)
     print(f"Дамп памяти с {args.start_addr} по {args.end_addr} в {args.dump_file}")
-    memory_dump = {}
-    for addr in range(args.start_addr, min(args.end_addr + 1, len(vm.memory))): # идея из файла преподавателя: цикл по памяти для дампа
-        memory_dump[str(addr)] = vm.memory[addr]
-
     try:
-        with open(args.dump_file, 'w', encoding='utf-8') as f:
-            json.dump(memory_dump, f, indent=2, ensure_ascii=False)
+        write_memory_dump(vm, args.dump_file, args.start_addr, args.end_addr, args.dump_format)
         print(f"Дамп памяти сохранён в {args.dump_file}")
     except Exception as e:
         print(f"Ошибка при сохранении дампа памяти: {e}")
@@ -0,0 +1,31 @@
+# Таблица ISA УВМ Вариант 20 - общая для ассемблера (12312312.py), интерпретатора (interpr.py)
+# и дизассемблера (disasm.py).
+# Команда - 3 байта Little-Endian: поле A (опкод) - биты 0-3, поле B (операнд) - с бита 4.
+
+INSTRUCTION_SIZE = 3 # размер команды в байтах
+OPCODE_BITS = 4
+
+# (мнемоника, опкод A, ширина поля B в битах; 0 - у команды нет операнда)
+INSTRUCTIONS = (
+    ("load", 1, 18),
+    ("read", 15, 6),
+    ("write", 3, 0),
+    ("gt", 5, 6),
+)
+
+OPCODES = {name: opcode for name, opcode, _ in INSTRUCTIONS} # мнемоника -> опкод
+MNEMONICS = {opcode: name for name, opcode, _ in INSTRUCTIONS} # опкод -> мнемоника
+OPERAND_BITS = {opcode: bits for _, opcode, bits in INSTRUCTIONS} # опкод -> ширина поля B
+
+
+def mask(n):
+    """Возвращает маску из n единиц (2^n - 1)."""
+    return (1 << n) - 1
+
+
+def operand_limits():
+    """Максимальное значение операнда для каждого из 16 опкодов (-1 - опкод не существует)."""
+    limits = [-1] * (1 << OPCODE_BITS)
+    for opcode, bits in OPERAND_BITS.items():
+        limits[opcode] = mask(bits)
+    return limits
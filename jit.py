@@ -0,0 +1,251 @@
+import hashlib
+
+from isa import INSTRUCTION_SIZE, mask
+from interpr import (DecodedProgram, CONST_BITS, CONST_MASK, OP_LOAD, OP_READ, OP_WRITE, OP_GT,
+                     OP_STORE_CONST, OP_READ_CONST, OP_GT_CONST, FUSED_STACK_DEPTH, decode_program, execute)
+
+# Компиляция декодированной программы в исходный текст Python.
+# Ветвлений в ISA нет, поэтому вся программа - один линейный участок: стек моделируется
+# при компиляции (константы load подставляются прямо в выражения), а в сгенерированном коде
+# остаются только обращения к памяти. Программа делится на части по CHUNK_SIZE операций,
+# каждая часть - отдельная функция; если при входе в часть стек УВМ не позволяет выполнить
+# её без ошибки (или в ней есть неизвестный опкод), часть выполняет эталонный интерпретатор.
+
+CHUNK_SIZE = 1024 # операций в одной сгенерированной функции
+CACHE_SIZE = 64 # количество скомпилированных программ в кэше
+
+_CACHE = {} # ключ (хэш программы, параметры памяти) -> CompiledProgram
+
+
+class _ChunkCompiler:
+    """Генерирует функцию для одной части программы, моделируя стек при компиляции."""
+    def __init__(self, memory_size, word_bits):
+        self.memory_size = memory_size
+        self.word_mask = mask(word_bits)
+        self.lines = []
+        self.stack = [] # символьный стек: int - константа, str - имя локальной переменной
+        self.need = 0 # сколько элементов снимается со стека УВМ, существовавшего до части
+        self.peak = 0 # максимальная глубина стека относительно начала части
+        self.temps = 0
+        self.dirty = set() # константные адреса записи
+
+    def push(self, value):
+        self.stack.append(value)
+        self.peak = max(self.peak, len(self.stack) - self.need)
+
+    def reserve(self, depth):
+        """Учитывает глубину стека, которую заняли бы исходные команды слитой операции."""
+        self.peak = max(self.peak, len(self.stack) - self.need + depth)
+
+    def pop(self):
+        if self.stack:
+            return self.stack.pop()
+        self.need += 1
+        return f"s{self.need}" # s1 = buf[sp - 1], s2 = buf[sp - 2], ...
+
+    def read(self, addr, offset=0):
+        self.temps += 1
+        temp = f"t{self.temps}"
+        if isinstance(addr, int):
+            addr += offset
+            if 0 <= addr < self.memory_size:
+                self.lines.append(f"{temp} = mem[{addr}]")
+            else:
+                self.lines.append(f"{temp} = vm.read_memory({addr})")
+        else:
+            self.lines.append(f"e = {addr} + {offset}")
+            self.lines.append(f"{temp} = mem[e] if 0 <= e < {self.memory_size} else vm.read_memory(e)")
+        self.push(temp)
+
+    def write(self, addr, value, masked):
+        """Запись value по адресу addr; masked - значение уже помещается в слово (результат gt)."""
+        if isinstance(value, int):
+            stored = value & self.word_mask
+        else:
+            stored = value if masked else f"{value} & {self.word_mask}"
+        if isinstance(addr, int):
+            if 0 <= addr < self.memory_size:
+                self.lines.append(f"mem[{addr}] = {stored}")
+                self.dirty.add(addr)
+            else:
+                self.lines.append(f"vm.write_memory({addr}, {value})")
+        else:
+            self.lines.append(f"e = {addr}")
+            self.lines.append(f"if 0 <= e < {self.memory_size}:")
+            self.lines.append(f"    mem[e] = {stored}")
+            self.lines.append("    dirty.add(e)")
+            self.lines.append("else:")
+            self.lines.append(f"    vm.write_memory(e, {value})")
+
+    def gt(self, offset):
+        val1 = self.pop()
+        val2 = self.pop()
+        addr = self.pop()
+        addr = addr + offset if isinstance(addr, int) else f"{addr} + {offset}"
+        if isinstance(val1, int) and isinstance(val2, int):
+            self.write(addr, 1 if val2 > val1 else 0, True)
+        else:
+            self.write(addr, f"(1 if {val2} > {val1} else 0)", True)
+
+    def compile(self, part, name):
+        """Исходный текст функции name(vm) для части программы или None при неизвестном опкоде."""
+        for opcode, operand in zip(part.opcodes, part.operands):
+            if opcode == OP_LOAD:
+                self.push(operand)
+            elif opcode == OP_READ:
+                self.read(self.pop(), operand)
+            elif opcode == OP_WRITE:
+                value = self.pop()
+                self.write(self.pop(), value, False)
+            elif opcode == OP_GT:
+                self.gt(operand)
+            elif opcode == OP_STORE_CONST:
+                self.reserve(FUSED_STACK_DEPTH[opcode])
+                self.write(operand >> CONST_BITS, operand & CONST_MASK, False)
+            elif opcode == OP_READ_CONST:
+                self.read(operand)
+            elif opcode == OP_GT_CONST:
+                self.reserve(FUSED_STACK_DEPTH[opcode])
+                self.write(operand >> 1, operand & 1, True)
+            else:
+                return None
+
+        need = self.need
+        head = [
+            f"def {name}(vm):",
+            "    buf = vm.stack_buffer",
+            "    sp = vm.sp",
+            f"    if sp < {need} or sp + {self.peak} > len(buf):",
+            "        return False",
+            "    mem = vm.memory",
+            "    dirty = vm.dirty",
+        ]
+        head.extend(f"    s{index} = buf[sp - {index}]" for index in range(1, need + 1))
+        body = [f"    {line}" for line in self.lines]
+        tail = [f"    buf[sp + {index - need}] = {value}" for index, value in enumerate(self.stack)]
+        tail.append(f"    vm.sp = sp + {len(self.stack) - need}")
+        if self.dirty:
+            tail.append(f"    dirty.update(({', '.join(map(str, sorted(self.dirty)))},))")
+        tail.append("    return True")
+        return "\n".join(head + body + tail) + "\n"
+
+
+class CompiledProgram:
+    """
+    Программа, скомпилированная в функции Python для заданных размера памяти и ширины слова.
+    run выполняет её на УВМ с теми же результатами и счётчиками, что и execute.
+    """
+    def __init__(self, program, memory_size, word_bits, chunk_size=CHUNK_SIZE):
+        self.program = program
+        self.memory_size = memory_size
+        self.word_bits = word_bits
+        self.parts = list(program.split(chunk_size)) if len(program) else []
+        sources = []
+        names = []
+        for index, part in enumerate(self.parts):
+            name = f"_chunk_{index}"
+            source = _ChunkCompiler(memory_size, word_bits).compile(part, name)
+            names.append(name if source is not None else None)
+            if source is not None:
+                sources.append(source)
+        self.source = "\n\n".join(sources)
+        self.code = compile(self.source, f"<uvm jit {program.size} bytes>", "exec")
+        namespace = {}
+        exec(self.code, namespace)
+        self.functions = [namespace[name] if name is not None else None for name in names]
+
+    def run(self, vm_instance):
+        """Выполняет программу на УВМ. Возвращает количество выполненных команд исходной программы."""
+        if vm_instance.memory_size != self.memory_size or vm_instance.word_bits != self.word_bits:
+            raise ValueError("Программа скомпилирована для другого размера памяти или ширины слова")
+        if not self.parts:
+            return execute(self.program, vm_instance)
+
+        # Как и execute, при исключении счётчики и pc УВМ не изменяются.
+        counters = vm_instance.executed_count, vm_instance.fused_count, vm_instance.pc
+        executed = 0
+        try:
+            for part, function in zip(self.parts, self.functions):
+                if function is not None and function(vm_instance):
+                    executed += part.instruction_count
+                    vm_instance.executed_count += part.instruction_count
+                    vm_instance.fused_count += part.fused_count
+                    vm_instance.pc = part.base_pc + part.instruction_count * INSTRUCTION_SIZE
+                    if vm_instance.pc < part.size:
+                        print(f"Предупреждение: Достигнут конец байткода на PC {vm_instance.pc}, остановка.")
+                else:
+                    part_executed = execute(part, vm_instance)
+                    executed += part_executed
+                    if part_executed < part.instruction_count:
+                        break # выполнение остановлено ошибкой
+        except Exception:
+            vm_instance.executed_count, vm_instance.fused_count, vm_instance.pc = counters
+            raise
+        return executed
+
+
+def program_key(bytecode, fuse=False, start_pc=0):
+    """Хэш программы для кэша: SHA-256 байткода (или массивов декодированной программы)."""
+    digest = hashlib.sha256()
+    if isinstance(bytecode, DecodedProgram):
+        digest.update(f"decoded:{bytecode.base_pc}:{bytecode.size}:".encode())
+        digest.update(bytecode.opcodes.tobytes())
+        digest.update(bytecode.operands.tobytes())
+    else:
+        digest.update(f"{int(fuse)}:{start_pc}:".encode())
+        digest.update(bytecode)
+    return digest.hexdigest()
+
+
+def compile_program(bytecode, memory_size, word_bits, fuse=False, start_pc=0):
+    """
+    Возвращает CompiledProgram для байткода или DecodedProgram. Скомпилированные программы
+    кэшируются по хэшу программы и параметрам памяти, повторная компиляция не выполняется.
+    """
+    key = (program_key(bytecode, fuse, start_pc), memory_size, word_bits)
+    compiled = _CACHE.pop(key, None)
+    if compiled is None:
+        program = bytecode if isinstance(bytecode, DecodedProgram) else decode_program(bytecode, fuse, start_pc)
+        compiled = CompiledProgram(program, memory_size, word_bits)
+        if len(_CACHE) >= CACHE_SIZE:
+            del _CACHE[next(iter(_CACHE))] # удаляется давно не использованная программа
+    _CACHE[key] = compiled
+    return compiled
+
+
+def clear_cache():
+    _CACHE.clear()
+
+
+def execute_jit(bytecode, vm_instance, fuse=False):
+    """
+    Аналог execute (режим quiet) через скомпилированную программу. Байткод выполняется
+    с vm_instance.pc; возвращает количество выполненных команд исходной программы.
+    """
+    start_pc = 0 if isinstance(bytecode, DecodedProgram) else vm_instance.pc
+    compiled = compile_program(bytecode, vm_instance.memory_size, vm_instance.word_bits, fuse, start_pc)
+    return compiled.run(vm_instance)
+
+
+def verify_jit(bytecode, vm_instance, fuse=False):
+    """
+    Выполняет программу эталонным интерпретатором и скомпилированной версией на копиях
+    vm_instance и сравнивает итоговое состояние (память, стек, pc, счётчики).
+    При расхождении - AssertionError. Возвращает (количество команд, УВМ после выполнения).
+    """
+    program = bytecode if isinstance(bytecode, DecodedProgram) else \
+        decode_program(bytecode, fuse, vm_instance.pc)
+    reference = vm_instance.clone()
+    reference_executed = execute(program, reference)
+    compiled_vm = vm_instance.clone()
+    executed = execute_jit(program, compiled_vm)
+
+    if reference.memory != compiled_vm.memory:
+        diff = [addr for addr, (a, b) in enumerate(zip(reference.memory, compiled_vm.memory)) if a != b]
+        raise AssertionError(f"Дампы памяти интерпретатора и скомпилированной программы различаются по адресам: {diff}")
+    for field in ("stack", "pc", "executed_count", "fused_count", "dirty"):
+        if getattr(reference, field) != getattr(compiled_vm, field):
+            raise AssertionError(f"Состояние УВМ после интерпретатора и скомпилированной программы различается: {field}")
+    if executed != reference_executed:
+        raise AssertionError("Количество выполненных команд различается")
+    return executed, compiled_vm
@@ -0,0 +1,137 @@
+import importlib
+
+from isa import OPCODES, OPERAND_BITS, mask
+from interpr import UVM, MEMORY_SIZE, WORD_BITS, execute
+
+# Оптимизатор промежуточного представления ({"op": ..., "args": [...]}) между разбором CSV
+# и кодированием. Ветвлений в ISA нет, поэтому команды, стоящие непосредственно перед
+# потребителем, - это ровно вершина стека в момент его выполнения:
+#   load a; load v; write        - запись константы v по известному адресу a;
+#   load a; read k               - чтение по известному адресу a + k;
+#   load a; load b; load c; gt k - сравнение констант с записью по адресу a + k.
+# Результат пересылки записей зависит от размера памяти и ширины слова УВМ, на которой
+# будет выполняться программа, поэтому они - параметры оптимизации (по умолчанию - как у UVM).
+
+# Версия оптимизатора: меняется при любом изменении проходов, входит в ключ кэша сборки
+# оптимизированных программ (build_cache.py, server.py).
+OPTIMIZER_VERSION = "1"
+
+MAX_CONST = mask(OPERAND_BITS[OPCODES["load"]])  # максимальная константа команды load
+
+
+def _load(value):
+    return {"op": "load", "args": [value]}
+
+
+def _is_load(instr):
+    return instr["op"] == "load" and len(instr["args"]) == 1
+
+
+def _is_op(instr, op, arg_count):
+    return instr["op"] == op and len(instr["args"]) == arg_count
+
+
+def _constant_store(program, i):
+    """Адрес записи константы, если program[i] - write из шаблона load a; load v; write, иначе None."""
+    if i >= 2 and _is_op(program[i], "write", 0) and _is_load(program[i - 1]) and _is_load(program[i - 2]):
+        return program[i - 2]["args"][0]
+    return None
+
+
+def fold_constant_gt(program):
+    """Заменяет load a; load b; load c; gt k на прямую запись результата: load a+k; load (b > c); write."""
+    result = []
+    for instr in program:
+        if _is_op(instr, "gt", 1) and len(result) >= 3 and all(_is_load(prev) for prev in result[-3:]):
+            addr, val2, val1 = (prev["args"][0] for prev in result[-3:])
+            effective_addr = addr + instr["args"][0]
+            if effective_addr <= MAX_CONST:
+                result[-3:] = [_load(effective_addr), _load(1 if val2 > val1 else 0), {"op": "write", "args": []}]
+                continue
+        result.append(instr)
+    return result
+
+
+def forward_stores(program, memory_size=MEMORY_SIZE, word_bits=WORD_BITS):
+    """
+    Заменяет load a; read k на load v, если по адресу a + k ранее записана константа v
+    и между записью и чтением не было записи по неизвестному адресу.
+    Начальное содержимое памяти считается неизвестным. Пересылаются только записи,
+    выполнимые в памяти из memory_size слов; v усекается до word_bits бит, как при записи.
+    """
+    word_mask = mask(word_bits)
+    result = []
+    known = {}  # адрес -> значение, записанное константной записью
+    for instr in program:
+        if _is_op(instr, "read", 1) and result and _is_load(result[-1]):
+            addr = result[-1]["args"][0] + instr["args"][0]
+            if addr in known:
+                result[-1] = _load(known[addr])
+                continue
+        elif _is_op(instr, "write", 0):
+            if len(result) >= 2 and _is_load(result[-1]) and _is_load(result[-2]):
+                addr = result[-2]["args"][0]
+                if 0 <= addr < memory_size:  # запись вне памяти не выполняется
+                    known[addr] = result[-1]["args"][0] & word_mask
+            else:
+                known.clear()
+        elif not (_is_load(instr) or _is_op(instr, "read", 1)):
+            known.clear()  # gt и любые нераспознанные команды могут писать по неизвестному адресу
+        result.append(instr)
+    return result
+
+
+def eliminate_dead_stores(program):
+    """
+    Удаляет load a; load v; write, если адрес a перезаписывается константной записью
+    позже, а между этими записями память по адресу a не читается.
+    """
+    removed = set()
+    overwritten = set()  # адреса, которые будут перезаписаны до ближайшего чтения
+    for i in range(len(program) - 1, -1, -1):
+        instr = program[i]
+        addr = _constant_store(program, i)
+        if addr is not None:
+            if addr in overwritten:
+                removed.update((i - 2, i - 1, i))
+            else:
+                overwritten.add(addr)
+        elif _is_op(instr, "read", 1):
+            if i >= 1 and _is_load(program[i - 1]):
+                overwritten.discard(program[i - 1]["args"][0] + instr["args"][0])
+            else:
+                overwritten.clear()  # чтение по неизвестному адресу
+        elif not (_is_load(instr) or _is_op(instr, "write", 0) or _is_op(instr, "gt", 1)):
+            overwritten.clear()
+    return [instr for i, instr in enumerate(program) if i not in removed]
+
+
+def optimize_program(program, memory_size=MEMORY_SIZE, word_bits=WORD_BITS):
+    """
+    Применяет все проходы оптимизации, пока программа сокращается.
+    memory_size и word_bits должны совпадать с параметрами УВМ, на которой выполняется программа.
+    """
+    while True:
+        optimized = fold_constant_gt(program)
+        optimized = forward_stores(optimized, memory_size, word_bits)
+        optimized = eliminate_dead_stores(optimized)
+        if len(optimized) >= len(program):
+            return optimized
+        program = optimized
+
+
+def verify_optimization(original, optimized, memory_size=MEMORY_SIZE, word_bits=WORD_BITS):
+    """
+    Выполняет исходную и оптимизированную программы на интерпретаторе и проверяет,
+    что итоговое содержимое памяти совпадает. При расхождении - AssertionError.
+    """
+    assembler = importlib.import_module("12312312")
+    memories = []
+    for program in (original, optimized):
+        vm = UVM(memory_size, word_bits)
+        execute(assembler.translate_to_machine_code_bytes(program), vm)
+        memories.append(vm.memory)
+
+    if memories[0] != memories[1]:
+        diff = [addr for addr, (a, b) in enumerate(zip(*memories)) if a != b]
+        raise AssertionError(f"Дампы памяти исходной и оптимизированной программ различаются по адресам: {diff}")
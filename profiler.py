@@ -0,0 +1,95 @@
+import json
+from collections import Counter
+
+from isa import MNEMONICS
+from interpr import (ExecutionHook, HANDLER_COUNT, CONST_BITS, OP_READ, OP_WRITE, OP_GT,
+                     OP_STORE_CONST, OP_READ_CONST, OP_GT_CONST, FUSED_STACK_DEPTH, format_instruction)
+
+# Имена операций в отчёте: мнемоники ISA и последовательности, заменяемые слитыми операциями.
+OPERATION_NAMES = {
+    **MNEMONICS,
+    OP_STORE_CONST: "load;load;write", OP_READ_CONST: "load;read", OP_GT_CONST: "load;load;load;gt",
+}
+
+
+def memory_access(opcode, operand, vm_instance):
+    """
+    Адрес обращения к памяти операции, вычисленный до её выполнения:
+    ("read" | "write", адрес) или None, если операция не обращается к памяти.
+    """
+    stack, sp = vm_instance.stack_buffer, vm_instance.sp
+    if opcode == OP_READ and sp >= 1:
+        return "read", stack[sp - 1] + operand
+    if opcode == OP_WRITE and sp >= 2:
+        return "write", stack[sp - 2]
+    if opcode == OP_GT and sp >= 3:
+        return "write", stack[sp - 3] + operand
+    if opcode == OP_READ_CONST:
+        return "read", operand
+    if opcode == OP_STORE_CONST:
+        return "write", operand >> CONST_BITS
+    if opcode == OP_GT_CONST:
+        return "write", operand >> 1
+    return None
+
+
+class Profiler(ExecutionHook):
+    """
+    Хук профилирования execute: количество и суммарное время выполнения по опкодам,
+    счётчики попаданий по PC, максимальная глубина стека и карты чтений/записей по адресам.
+    Один профайлер можно передавать в несколько запусков - данные накапливаются.
+    """
+    def __init__(self):
+        self.opcode_counts = [0] * HANDLER_COUNT
+        self.opcode_seconds = [0.0] * HANDLER_COUNT
+        self.pc_hits = Counter()
+        self.instructions = {} # PC -> текстовое представление операции
+        self.max_stack_depth = 0
+        self.memory_reads = Counter()
+        self.memory_writes = Counter()
+        self.runs = 0
+
+    def on_start(self, program, vm_instance):
+        self.runs += 1
+        self.max_stack_depth = max(self.max_stack_depth, vm_instance.sp)
+
+    def on_step(self, pc, opcode, operand, vm_instance):
+        self.pc_hits[pc] += 1
+        # Слитая операция не кладёт значения на стек: учитывается глубина, которую заняли бы
+        # исходные команды, чтобы результат не зависел от --fuse.
+        depth = vm_instance.sp + FUSED_STACK_DEPTH.get(opcode, 0)
+        if depth > self.max_stack_depth:
+            self.max_stack_depth = depth
+        if pc not in self.instructions:
+            self.instructions[pc] = format_instruction(opcode, operand)
+        access = memory_access(opcode, operand, vm_instance)
+        if access is not None:
+            kind, addr = access
+            (self.memory_reads if kind == "read" else self.memory_writes)[addr] += 1
+
+    def after_step(self, pc, opcode, operand, elapsed, vm_instance):
+        self.opcode_counts[opcode] += 1
+        self.opcode_seconds[opcode] += elapsed
+        if vm_instance.sp > self.max_stack_depth:
+            self.max_stack_depth = vm_instance.sp
+
+    def report(self, top=20):
+        """Отчёт в виде словаря, пригодного для сохранения в JSON; top - число самых горячих PC."""
+        opcodes = {
+            OPERATION_NAMES.get(opcode, str(opcode)): {"count": count, "seconds": self.opcode_seconds[opcode]}
+            for opcode, count in enumerate(self.opcode_counts) if count
+        }
+        return {
+            "runs": self.runs,
+            "steps": sum(self.opcode_counts),
+            "opcodes": opcodes,
+            "hot_pcs": [{"pc": pc, "hits": hits, "instruction": self.instructions[pc]}
+                        for pc, hits in self.pc_hits.most_common(top)],
+            "max_stack_depth": self.max_stack_depth,
+            "memory_reads": {str(addr): count for addr, count in sorted(self.memory_reads.items())},
+            "memory_writes": {str(addr): count for addr, count in sorted(self.memory_writes.items())},
+        }
+
+    def save_report(self, report_file, top=20):
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(self.report(top), f, indent=2, ensure_ascii=False)
@@ -0,0 +1,401 @@
+import io
+import os
+import sys
+import csv
+import json
+import stat
+import base64
+import asyncio
+import hashlib
+import argparse
+import importlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import jit
+import optimizer
+from batch_run import apply_memory_image
+from interpr import UVM, MEMORY_SIZE, STACK_SIZE, WORD_BITS, decode_program, execute, memory_dump, sparse_memory_dump
+
+assembler = importlib.import_module("12312312")
+
+# Сервис ассемблирования и выполнения программ УВМ. Протокол - JSON Lines: каждый запрос
+# и каждый ответ - один JSON-объект в отдельной строке. Запросы одного соединения
+# обрабатываются параллельно (клиент может отправлять их, не дожидаясь ответов), поэтому
+# ответы приходят по мере готовности и сопоставляются с запросами по полю "id".
+# Сервис не обращается к файловой системе по запросам клиентов: программы передаются
+# только в самих запросах (исходный текст или байткод).
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BATCH_SIZE = 256 # максимальное количество запусков, передаваемых исполнителю за один раз
+MAX_PENDING = 1024 # максимальное количество незавершённых запросов одного соединения
+MAX_LINE_SIZE = 64 * 1024 * 1024 # максимальная длина строки запроса в байтах
+PROGRAM_CACHE_SIZE = 1024 # программ в кэше сервера и декодированных программ в кэше исполнителя
+
+# Поля запроса run, передаваемые исполнителю.
+RUN_FIELDS = ("memory", "start_addr", "end_addr", "memory_size", "word_bits", "stack_size", "fuse", "sparse", "jit")
+
+# Декодированные программы процесса-исполнителя: (ключ программы, fuse) -> DecodedProgram.
+_DECODED = {}
+
+
+def program_key(bytecode):
+    """Ключ программы в кэшах: SHA-256 байткода."""
+    return hashlib.sha256(bytecode).hexdigest()
+
+
+def _cache_get(cache, key):
+    value = cache.pop(key, None)
+    if value is not None:
+        cache[key] = value # запись становится последней использованной
+    return value
+
+
+def _cache_put(cache, key, value, limit=PROGRAM_CACHE_SIZE):
+    """Добавляет запись в кэш-словарь; при переполнении удаляется давно не использованная."""
+    cache.pop(key, None)
+    if len(cache) >= limit:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+
+def assemble_source(source, optimize=False, memory_size=MEMORY_SIZE, word_bits=WORD_BITS):
+    """
+    Ассемблирует текст программы в формате CSV и возвращает байткод.
+    memory_size и word_bits - параметры УВМ, для которой оптимизируется программа.
+    """
+    intermediate_program = []
+    # Ошибки разбора возвращаются клиенту в ответе, а не печатаются сервисом (как в iter_csv_lines).
+    for line_number, row in enumerate(csv.reader(io.StringIO(source)), start=1):
+        try:
+            instruction = assembler.parse_csv_row(row)
+        except ValueError as e:
+            raise ValueError(f"Ошибка разбора в строке {line_number}: {e}") from None
+        if instruction:
+            intermediate_program.append(instruction)
+    if optimize:
+        intermediate_program = optimizer.optimize_program(intermediate_program, memory_size, word_bits)
+    return assembler.translate_to_machine_code_bytes(intermediate_program)
+
+
+def run_program(job):
+    """
+    Выполняет один запуск в процессе-исполнителе. job - поля запроса run (RUN_FIELDS),
+    а также "key" и "bytecode" программы. Программа декодируется один раз на процесс.
+    """
+    fuse = job.get("fuse", False)
+    program = _cache_get(_DECODED, (job["key"], fuse))
+    if program is None:
+        program = decode_program(job["bytecode"], fuse=fuse)
+        _cache_put(_DECODED, (job["key"], fuse), program)
+
+    vm = UVM(job.get("memory_size", MEMORY_SIZE), job.get("word_bits", WORD_BITS), job.get("stack_size", STACK_SIZE))
+    start_addr, end_addr = job.get("start_addr", 0), job.get("end_addr", vm.memory_size - 1)
+    if start_addr < 0 or end_addr < start_addr or end_addr >= vm.memory_size:
+        raise ValueError(f"Неверный диапазон памяти [{start_addr}, {end_addr}]. "
+                         f"Должно быть 0 <= start <= end < {vm.memory_size}.")
+    apply_memory_image(vm, job.get("memory", {}))
+    if job.get("jit"):
+        executed = jit.compile_program(program, vm.memory_size, vm.word_bits).run(vm)
+    else:
+        executed = execute(program, vm)
+    dump = sparse_memory_dump if job.get("sparse") else memory_dump
+    return {"executed": executed, "fused": vm.fused_count,
+            "dump": dump(vm, start_addr, end_addr)}
+
+
+def run_programs(jobs):
+    """Выполняет порцию запусков; ошибка одного запуска не прерывает остальные."""
+    results = []
+    for job in jobs:
+        try:
+            results.append(run_program(job))
+        except Exception as e:
+            results.append({"error": str(e)})
+    return results
+
+
+class UVMService:
+    """
+    Обработчик запросов сервиса. Типы запросов ("type"):
+      assemble     - {"source": текст CSV, "optimize": bool,
+                      "memory_size", "word_bits" - параметры УВМ для оптимизатора}
+                     -> {"program": ключ, "size": байт, "bytecode": base64};
+      run          - {"program": ключ | "bytecode": base64, поля RUN_FIELDS}
+                     -> {"executed": команд, "fused": слитых операций, "dump": дамп памяти};
+      assemble_run - поля assemble и run, ответ содержит поля обоих;
+      batch        - {"requests": [запрос, ...]} -> {"responses": [ответ, ...]};
+      stats        - счётчики сервиса.
+    Запуски из всех соединений собираются в порции до batch_size и выполняются в пуле процессов
+    (workers=0 - в процессе сервера), поэтому цикл событий не блокируется выполнением программ.
+    """
+    def __init__(self, workers=None, batch_size=MAX_BATCH_SIZE):
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers != 0 else None
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.programs = {} # ключ программы -> байткод
+        self.sources = {} # хэш (версии ассемблера и оптимизатора, параметры УВМ, исходный текст) -> ключ программы
+        self.queue = None
+        self.stats = {"requests": 0, "errors": 0, "assembled": 0, "runs": 0, "batches": 0}
+        self._tasks = set()
+
+    def start(self):
+        """Запускает распределение запусков по исполнителям (внутри работающего цикла событий)."""
+        self.queue = asyncio.Queue()
+        self._spawn(self._dispatch())
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _dispatch(self):
+        # Не больше двух порций на исполнитель: пока все заняты, запуски копятся в очереди
+        # и уходят следующей порцией целиком.
+        slots = asyncio.Semaphore(2 * self.workers)
+        while True:
+            await slots.acquire()
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self._spawn(self._run_batch(batch, slots))
+
+    async def _run_batch(self, batch, slots):
+        jobs = [job for job, _ in batch]
+        try:
+            if self.executor is None:
+                results = run_programs(jobs)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, run_programs, jobs)
+        except Exception as e:
+            results = [{"error": str(e)}] * len(batch)
+        finally:
+            slots.release()
+        self.stats["batches"] += 1
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def assemble(self, request):
+        source = request["source"]
+        if not isinstance(source, str):
+            raise ValueError("Поле source должно содержать текст программы")
+        optimize = bool(request.get("optimize", False))
+        # Оптимизация зависит от параметров УВМ: берутся те же поля, что и у запроса run.
+        memory_size, word_bits = request.get("memory_size", MEMORY_SIZE), request.get("word_bits", WORD_BITS)
+        optimizer_version = optimizer.OPTIMIZER_VERSION if optimize else "-"
+        source_hash = hashlib.sha256(f"{assembler.ASSEMBLER_VERSION}:{optimizer_version}:{memory_size}:{word_bits}:"
+                                     f"{source}".encode()).hexdigest()
+
+        key = _cache_get(self.sources, source_hash)
+        bytecode = _cache_get(self.programs, key) if key is not None else None
+        if bytecode is None:
+            if self.executor is None:
+                bytecode = assemble_source(source, optimize, memory_size, word_bits)
+            else:
+                bytecode = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, assemble_source, source, optimize, memory_size, word_bits)
+            key = program_key(bytecode)
+            _cache_put(self.sources, source_hash, key)
+            _cache_put(self.programs, key, bytecode)
+            self.stats["assembled"] += 1
+        return {"program": key, "size": len(bytecode), "bytecode": base64.b64encode(bytecode).decode('ascii')}
+
+    def _program(self, request):
+        """Ключ и байткод программы запроса run."""
+        if "bytecode" in request:
+            bytecode = base64.b64decode(request["bytecode"])
+        else:
+            key = request["program"]
+            bytecode = _cache_get(self.programs, key)
+            if bytecode is None:
+                raise ValueError(f"Программа {key} отсутствует в кэше сервера")
+            return key, bytecode
+        key = program_key(bytecode)
+        _cache_put(self.programs, key, bytecode)
+        return key, bytecode
+
+    async def run(self, request):
+        key, bytecode = self._program(request)
+        job = {field: request[field] for field in RUN_FIELDS if field in request}
+        job["key"] = key
+        job["bytecode"] = bytecode
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((job, future))
+        result = await future
+        self.stats["runs"] += 1
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return dict(result, program=key)
+
+    async def handle(self, request):
+        """Обрабатывает один запрос и возвращает ответ; ошибки возвращаются в поле "error"."""
+        self.stats["requests"] += 1
+        response = {"id": request.get("id")} if isinstance(request, dict) else {"id": None}
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Запрос должен быть JSON-объектом")
+            kind = request.get("type")
+            if kind == "assemble":
+                response.update(await self.assemble(request))
+            elif kind == "run":
+                response.update(await self.run(request))
+            elif kind == "assemble_run":
+                assembled = await self.assemble(request)
+                response.update(assembled)
+                response.update(await self.run(dict(request, program=assembled["program"])))
+            elif kind == "batch":
+                response["responses"] = await asyncio.gather(*(self.handle(r) for r in request["requests"]))
+            elif kind == "stats":
+                response.update(self.stats, programs=len(self.programs))
+            else:
+                raise ValueError(f"Неизвестный тип запроса: {kind}")
+            response["ok"] = True
+        except KeyError as e:
+            response = {"id": response["id"], "ok": False, "error": f"Отсутствует поле запроса: {e}"}
+        except Exception as e:
+            response = {"id": response["id"], "ok": False, "error": str(e) or type(e).__name__}
+        if not response["ok"]:
+            self.stats["errors"] += 1
+        return response
+
+    async def _respond(self, line, writer, pending):
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self.stats["errors"] += 1
+                response = {"id": None, "ok": False, "error": f"Неверный JSON: {e}"}
+            else:
+                response = await self.handle(request)
+            writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass # клиент отключился, не дождавшись ответа
+        finally:
+            pending.release()
+
+    async def serve_connection(self, reader, writer):
+        """Читает запросы соединения построчно и отвечает на каждый по мере готовности."""
+        pending = asyncio.Semaphore(MAX_PENDING)
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # строка длиннее MAX_LINE_SIZE
+                    writer.write(json.dumps({"id": None, "ok": False, "error": "Слишком длинный запрос"}).encode() + b"\n")
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await pending.acquire()
+                task = self._spawn(self._respond(line, writer, pending))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class ServiceClient:
+    """
+    Асинхронный клиент сервиса. call отправляет запрос, не дожидаясь ответов на предыдущие,
+    и возвращает ответ с тем же id; несколько call можно выполнять одновременно (asyncio.gather).
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {} # id запроса -> future ответа
+        self.receiver = asyncio.get_running_loop().create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        if socket_path:
+            reader, writer = await asyncio.open_unix_connection(socket_path, limit=MAX_LINE_SIZE)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE_SIZE)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        try:
+            while line := await self.reader.readline():
+                response = json.loads(line)
+                future = self.waiting.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Соединение с сервером закрыто"))
+
+    async def call(self, request):
+        request = dict(request, id=next(self.ids))
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request["id"]] = future
+        self.writer.write(json.dumps(request).encode('utf-8') + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+async def serve(socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, batch_size=MAX_BATCH_SIZE):
+    """Запускает сервис на Unix-сокете socket_path или на TCP host:port и обслуживает запросы до остановки."""
+    service = UVMService(workers, batch_size)
+    service.start()
+    try:
+        if socket_path:
+            if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.remove(socket_path) # сокет, оставшийся от предыдущего запуска
+            server = await asyncio.start_unix_server(service.serve_connection, socket_path, limit=MAX_LINE_SIZE)
+            address = socket_path
+        else:
+            server = await asyncio.start_server(service.serve_connection, host, port, limit=MAX_LINE_SIZE)
+            address = f"{host}:{port}"
+        print(f"Сервис УВМ запущен на {address} (исполнителей: {service.workers if service.executor else 0})")
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервис ассемблирования и выполнения программ УВМ Вариант 20 (JSON Lines).")
+    parser.add_argument("--socket", help="Путь к Unix-сокету (по умолчанию - TCP).")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Адрес TCP.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Порт TCP.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Количество процессов-исполнителей (по умолчанию - число ядер, 0 - в процессе сервиса).")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="Максимальное количество запусков, передаваемых исполнителю за один раз.")
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.socket, args.host, args.port, args.workers, args.batch_size))
+    except KeyboardInterrupt:
+        print("Сервис остановлен.")
+    except OSError as e:
+        print(f"Ошибка запуска сервиса: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()